@@ -0,0 +1,247 @@
+from __future__ import annotations
+
+import threading
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Set, Tuple
+
+from .compact import NodeRec, PackedDoc
+from .refs import pair_key
+
+# Graph analytics over manual links + visible Rule B auto links, treated as an
+# undirected multigraph. The index is synced lazily from the packed cache: since
+# unchanged NodeRecs are shared between states, only nodes whose record object
+# changed are re-indexed. Degrees and edge weights are updated in place;
+# union-find absorbs edge additions and is rebuilt only after an edge disappears.
+
+Pair = Tuple[str, str]
+
+
+class _UnionFind:
+    def __init__(self) -> None:
+        self.parent: Dict[str, str] = {}
+
+    def find(self, x: str) -> str:
+        parent = self.parent
+        root = parent.setdefault(x, x)
+        while parent[root] != root:
+            root = parent[root]
+        while parent[x] != root:
+            parent[x], x = root, parent[x]
+        return root
+
+    def union(self, a: str, b: str) -> None:
+        ra, rb = self.find(a), self.find(b)
+        if ra != rb:
+            self.parent[ra] = rb
+
+
+class GraphIndex:
+    def __init__(self) -> None:
+        self.doc: PackedDoc | None = None
+        self.recs: Dict[str, NodeRec] = {}
+        self.titles: Dict[str, str] = {}
+        self.tags: Dict[str, List[str]] = {}
+        # Rule B: explicit (key, value) match keys and (tag, name) claims per node
+        self.node_fields: Dict[str, Set[Pair]] = {}
+        self.node_claims: Dict[str, Set[Pair]] = {}
+        self.fields_idx: Dict[Pair, Set[str]] = {}
+        self.claims_idx: Dict[Pair, Set[str]] = {}
+        self.auto: Dict[Pair, int] = {}  # pair -> number of supporting matches
+        self.manual: Dict[Pair, int] = {}
+        self.links: Dict[Any, Pair] = {}
+        self.suppressed: Set[Pair] = set()
+        # visible graph
+        self.weight: Dict[Pair, int] = {}
+        self.adj: Dict[str, Dict[str, int]] = {}
+        self.degree: Dict[str, int] = {}
+        self.uf = _UnionFind()
+        self.uf_stale = False
+
+    # --- edge bookkeeping -------------------------------------------------
+    def _refresh(self, pair: Pair) -> None:
+        old = self.weight.get(pair, 0)
+        new = self.manual.get(pair, 0) + (1 if self.auto.get(pair, 0) > 0 and pair not in self.suppressed else 0)
+        if new == old:
+            return
+        a, b = pair
+        if new:
+            self.weight[pair] = new
+            self.adj.setdefault(a, {})[b] = new
+            self.adj.setdefault(b, {})[a] = new
+        else:
+            self.weight.pop(pair, None)
+            self.adj.get(a, {}).pop(b, None)
+            self.adj.get(b, {}).pop(a, None)
+        self.degree[a] = self.degree.get(a, 0) + new - old
+        self.degree[b] = self.degree.get(b, 0) + new - old
+        if old == 0:
+            if not self.uf_stale:
+                self.uf.union(a, b)
+        elif new == 0:
+            self.uf_stale = True
+
+    def _bump_auto(self, a: str, b: str, delta: int) -> None:
+        pair = pair_key(a, b)
+        if pair is None or a == b:
+            return
+        n = self.auto.get(pair, 0) + delta
+        if n > 0:
+            self.auto[pair] = n
+        else:
+            self.auto.pop(pair, None)
+        self._refresh(pair)
+
+    # --- nodes --------------------------------------------------------------
+    def _add_node(self, rec: NodeRec) -> None:
+        nid = rec.id
+        n = rec.unpack()
+        fields = [f for f in n.get("fields", []) or [] if isinstance(f, dict)]
+        self.recs[nid] = rec
+        self.titles[nid] = next((str(f["value"]).strip() for f in fields if f.get("key") == "名称" and isinstance(f.get("value"), str) and f["value"].strip()), nid)
+        keys = rec.match_keys()
+        names, tags = keys.names_tags()
+        self.tags[nid] = [t for t, _ in tags]
+        fset = set(keys.pairs())
+        cset = {(tk, nk) for _, tk in tags for _, nk in names}
+        # edges where this node is the explicit-field side, then the tagged side
+        for key in fset:
+            for m in self.claims_idx.get(key, ()):
+                self._bump_auto(m, nid, 1)
+        for key in cset:
+            for t in self.fields_idx.get(key, ()):
+                self._bump_auto(nid, t, 1)
+        for key in fset:
+            self.fields_idx.setdefault(key, set()).add(nid)
+        for key in cset:
+            self.claims_idx.setdefault(key, set()).add(nid)
+        self.node_fields[nid] = fset
+        self.node_claims[nid] = cset
+        self.adj.setdefault(nid, {})
+        self.degree.setdefault(nid, 0)
+        if not self.uf_stale:
+            self.uf.find(nid)
+
+    def _remove_node(self, nid: str) -> None:
+        fset = self.node_fields.pop(nid, set())
+        cset = self.node_claims.pop(nid, set())
+        for key in fset:
+            self.fields_idx.get(key, set()).discard(nid)
+        for key in cset:
+            self.claims_idx.get(key, set()).discard(nid)
+        for key in fset:
+            for m in self.claims_idx.get(key, ()):
+                self._bump_auto(m, nid, -1)
+        for key in cset:
+            for t in self.fields_idx.get(key, ()):
+                self._bump_auto(nid, t, -1)
+        self.recs.pop(nid, None)
+        self.titles.pop(nid, None)
+        self.tags.pop(nid, None)
+        if not self.adj.get(nid) and not self.degree.get(nid):
+            self.adj.pop(nid, None)
+            self.degree.pop(nid, None)
+
+    # --- sync -----------------------------------------------------------------
+    def sync(self, doc: PackedDoc) -> None:
+        if doc is self.doc:
+            return
+        new_recs = {r.id: r for r in doc.nodes if isinstance(r.id, str)}
+        # changed records are removed and re-added
+        removed = [nid for nid, rec in self.recs.items() if new_recs.get(nid) is not rec]
+        for nid in removed:
+            self._remove_node(nid)
+        for nid, rec in new_recs.items():
+            if nid not in self.recs:
+                self._add_node(rec)
+
+        links: Dict[Any, Pair] = {}
+        for i, l in enumerate(doc.rest.get("links", []) or []):
+            s, t = l.get("source"), l.get("target")
+            pair = pair_key(s, t)
+            if pair is not None and s != t:
+                links[l.get("id", i)] = pair
+        for lid, pair in self.links.items():
+            if links.get(lid) != pair:
+                self.manual[pair] -= 1
+                if self.manual[pair] <= 0:
+                    self.manual.pop(pair)
+                self._refresh(pair)
+        for lid, pair in links.items():
+            if self.links.get(lid) != pair:
+                self.manual[pair] = self.manual.get(pair, 0) + 1
+                self._refresh(pair)
+        self.links = links
+
+        suppressed = {k for k in (pair_key(p.get("a"), p.get("b")) for p in doc.rest.get("suppressedAutoPairs", []) or [] if isinstance(p, dict)) if k is not None}
+        changed = suppressed ^ self.suppressed
+        self.suppressed = suppressed
+        for pair in changed:
+            self._refresh(pair)
+        self.doc = doc
+
+    # --- queries --------------------------------------------------------------
+    def _uf(self) -> _UnionFind:
+        if self.uf_stale:
+            uf = _UnionFind()
+            for nid in self.recs:
+                uf.find(nid)
+            for a, b in self.weight:
+                uf.union(a, b)
+            self.uf = uf
+            self.uf_stale = False
+        return self.uf
+
+    def node_info(self, nid: str) -> Dict[str, Any]:
+        return {"id": nid, "title": self.titles.get(nid, nid), "tags": self.tags.get(nid, []), "degree": self.degree.get(nid, 0), "neighbors": len(self.adj.get(nid, {}))}
+
+    def components(self) -> List[List[str]]:
+        uf = self._uf()
+        groups: Dict[str, List[str]] = {}
+        for nid in self.recs:
+            groups.setdefault(uf.find(nid), []).append(nid)
+        return sorted(groups.values(), key=len, reverse=True)
+
+    def isolated(self) -> List[str]:
+        return [nid for nid in self.recs if not self.adj.get(nid)]
+
+    def hubs(self, limit: int, tag: str | None = None) -> List[str]:
+        ids = [nid for nid in self.recs if tag is None or tag in self.tags.get(nid, [])]
+        ids.sort(key=lambda x: (-len(self.adj.get(x, {})), -self.degree.get(x, 0), self.titles.get(x, x)))
+        return ids[:limit]
+
+    def shortest_path(self, src: str, dst: str) -> List[str] | None:
+        if src not in self.recs or dst not in self.recs:
+            return None
+        if src == dst:
+            return [src]
+        uf = self._uf()
+        if uf.find(src) != uf.find(dst):
+            return None
+        prev: Dict[str, str] = {src: src}
+        q = deque([src])
+        while q:
+            cur = q.popleft()
+            for nb in self.adj.get(cur, {}):
+                if nb in prev or nb not in self.recs:
+                    continue
+                prev[nb] = cur
+                if nb == dst:
+                    path = [dst]
+                    while path[-1] != src:
+                        path.append(prev[path[-1]])
+                    return path[::-1]
+                q.append(nb)
+        return None
+
+
+_INDEX = GraphIndex()
+_LOCK = threading.Lock()
+
+
+@contextmanager
+def synced(doc: PackedDoc) -> Iterator[GraphIndex]:
+    """Lock the shared index, bring it up to date with doc and yield it."""
+    with _LOCK:
+        _INDEX.sync(doc)
+        yield _INDEX
@@ -0,0 +1,182 @@
+from __future__ import annotations
+
+import sys
+from copy import deepcopy
+from typing import Any, Dict, List, Tuple
+
+from .matching import NodeKeys, is_current, stored_keys
+
+# Compact in-memory form of the data document.
+#
+# Nodes become NodeRec (__slots__) holding a tuple of field tuples
+# (key, type code, value) with interned keys/tags and enum-coded types, instead
+# of a dict per node plus a dict per field. Everything else (links, groups, ...)
+# stays in `rest` as plain JSON. Packed documents are treated as immutable, so
+# unchanged NodeRecs are shared between the cache and undo snapshots. Each
+# NodeRec also keeps what its Rule B match keys need beyond the raw strings
+# (matching.stored_keys: usually nothing, a shared marker), computed when the
+# record is packed, i.e. when the node's fields are written; match_keys() reads
+# the keys off the field tuples with it.
+# Conversion to/from the JSON shape happens only in storage.read_all/write_all
+# and at the undo boundary.
+
+FIELD_TYPES = ("text", "tag", "ref", "number")
+_TYPE_CODE = {t: i for i, t in enumerate(FIELD_TYPES)}
+_MISSING = object()
+_FIELD_KEYS = ("key", "type", "value")
+_SCALARS = (str, int, float, bool, type(None))
+
+Field = Any  # Tuple[str, int | str, Any] or a dict fallback for unusual shapes
+
+
+def _intern(v: Any) -> Any:
+    return sys.intern(v) if isinstance(v, str) else v
+
+
+def _pack_field(f: Any) -> Field:
+    # Only the common shape is packed: string key and type, scalar value.
+    # Anything else stays a dict so it round-trips exactly.
+    if (
+        isinstance(f, dict) and len(f) == 3 and all(k in f for k in _FIELD_KEYS)
+        and isinstance(f["key"], str) and isinstance(f["type"], str) and isinstance(f["value"], _SCALARS)
+    ):
+        t = f["type"]
+        code = _TYPE_CODE.get(t, _intern(t))
+        v = f["value"]
+        # tag values repeat across nodes like keys do
+        if t == "tag" or (isinstance(v, str) and len(v) <= 16):
+            v = _intern(v)
+        return (_intern(f["key"]), code, v)
+    return deepcopy(f)
+
+
+def _unpack_field(f: Field) -> Any:
+    if isinstance(f, tuple):
+        code = f[1]
+        return {"key": f[0], "type": FIELD_TYPES[code] if isinstance(code, int) else code, "value": f[2]}
+    return deepcopy(f)
+
+
+def _same(a: Any, b: Any) -> bool:
+    # 1 == 1.0 == True in Python, but they serialize differently
+    return type(a) is type(b) and a == b
+
+
+def _field_matches(packed: Field, f: Any) -> bool:
+    if isinstance(packed, tuple):
+        if not isinstance(f, dict) or len(f) != 3 or "value" not in f:
+            return False
+        code = packed[1]
+        t = FIELD_TYPES[code] if isinstance(code, int) else code
+        return f.get("key") == packed[0] and f.get("type") == t and _same(f["value"], packed[2])
+    return packed == f
+
+
+class NodeRec:
+    __slots__ = ("id", "fields", "position", "extra", "keys")
+
+    def __init__(self, id: Any, fields: Tuple[Field, ...] | Any, position: Any, extra: Dict[str, Any] | None, keys: Any = None) -> None:
+        self.id = id
+        self.fields = fields
+        self.position = position
+        self.extra = extra
+        self.keys = keys
+
+    @classmethod
+    def pack(cls, n: Dict[str, Any]) -> "NodeRec":
+        fields = n.get("fields", _MISSING)
+        packed_fields: Any = fields  # deepcopy would clone the _MISSING sentinel
+        if isinstance(fields, list):
+            packed_fields = tuple(_pack_field(f) for f in fields)
+        elif fields is not _MISSING:
+            packed_fields = deepcopy(fields)
+        pos = n.get("position", _MISSING)
+        if isinstance(pos, dict) and len(pos) == 2 and isinstance(pos.get("x"), (int, float)) and isinstance(pos.get("y"), (int, float)):
+            pos = (pos["x"], pos["y"])
+        elif pos is not _MISSING:
+            pos = [deepcopy(pos)]  # non-standard shape, boxed to tell it apart from (x, y)
+        extra = {k: deepcopy(v) for k, v in n.items() if k not in ("id", "fields", "position")} or None
+        keys = stored_keys(packed_fields, FIELD_TYPES) if isinstance(packed_fields, tuple) else None
+        return cls(_intern(n.get("id", _MISSING)), packed_fields, pos, extra, keys)
+
+    def match_keys(self) -> NodeKeys:
+        fields = self.fields if isinstance(self.fields, tuple) else ()
+        # Recomputed only if MATCH_NORMALIZE was reconfigured since packing
+        if not is_current(self.keys):
+            self.keys = stored_keys(fields, FIELD_TYPES)
+        return NodeKeys(fields, self.keys, FIELD_TYPES)
+
+    def unpack(self) -> Dict[str, Any]:
+        out: Dict[str, Any] = {}
+        if self.id is not _MISSING:
+            out["id"] = self.id
+        if isinstance(self.fields, tuple):
+            out["fields"] = [_unpack_field(f) for f in self.fields]
+        elif self.fields is not _MISSING:
+            out["fields"] = deepcopy(self.fields)
+        if isinstance(self.position, tuple):
+            out["position"] = {"x": self.position[0], "y": self.position[1]}
+        elif self.position is not _MISSING:
+            out["position"] = deepcopy(self.position[0])
+        if self.extra:
+            out.update(deepcopy(self.extra))
+        return out
+
+    def matches(self, n: Dict[str, Any]) -> bool:
+        # Cheap equality against a JSON node, without building one
+        if n.get("id", _MISSING) != self.id:
+            return False
+        fields = n.get("fields", _MISSING)
+        if isinstance(self.fields, tuple):
+            if not isinstance(fields, list) or len(fields) != len(self.fields):
+                return False
+            for pf, f in zip(self.fields, fields):
+                if not _field_matches(pf, f):
+                    return False
+        elif fields != self.fields:
+            return False
+        pos = n.get("position", _MISSING)
+        if isinstance(self.position, tuple):
+            if not isinstance(pos, dict) or len(pos) != 2 or not _same(pos.get("x"), self.position[0]) or not _same(pos.get("y"), self.position[1]):
+                return False
+        elif self.position is _MISSING:
+            if pos is not _MISSING:
+                return False
+        elif pos != self.position[0]:
+            return False
+        extra = {k: v for k, v in n.items() if k not in ("id", "fields", "position")} or None
+        return extra == self.extra
+
+
+class PackedDoc:
+    __slots__ = ("nodes", "rest")
+
+    def __init__(self, nodes: Tuple[NodeRec, ...], rest: Dict[str, Any]) -> None:
+        self.nodes = nodes
+        self.rest = rest
+
+    def match_keys(self) -> List[NodeKeys]:
+        """Match keys from the stored ones, aligned with unpack(self)["nodes"]."""
+        return [r.match_keys() for r in self.nodes]
+
+
+def pack(data: Dict[str, Any], base: PackedDoc | None = None) -> PackedDoc:
+    """Pack a JSON document, reusing NodeRecs from base that are unchanged."""
+    by_id: Dict[Any, NodeRec] = {}
+    if base is not None:
+        for rec in base.nodes:
+            by_id.setdefault(rec.id, rec)
+    recs: List[NodeRec] = []
+    for n in data.get("nodes", []) or []:
+        if not isinstance(n, dict):
+            continue
+        old = by_id.get(n.get("id", _MISSING))
+        recs.append(old if old is not None and old.matches(n) else NodeRec.pack(n))
+    rest = {k: deepcopy(v) for k, v in data.items() if k != "nodes"}
+    return PackedDoc(tuple(recs), rest)
+
+
+def unpack(doc: PackedDoc) -> Dict[str, Any]:
+    out: Dict[str, Any] = {"nodes": [r.unpack() for r in doc.nodes]}
+    out.update(deepcopy(doc.rest))
+    return out
@@ -0,0 +1,355 @@
+"""Replay / load-test harness.
+
+Drives the app with N concurrent simulated clients, either replaying a file
+recorded by RECORD_REQUESTS or generating a prep-session mix (drags, edits,
+refreshes, undo). Reports p50/p95/p99 latency and throughput per route and
+compares against a saved baseline.
+
+    python -m app.loadtest --clients 8 --ops 200
+    python -m app.loadtest --replay session.jsonl --target http://127.0.0.1:5000
+    python -m app.loadtest --save-baseline bench.json
+    python -m app.loadtest --baseline bench.json --threshold 1.25
+"""
+
+from __future__ import annotations
+
+import argparse
+import math
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from typing import Any, Callable, Dict, List, Tuple
+
+from .storage import dumps_bytes, loads_bytes
+
+# (method, path, json body or None, raw text body or None, content type)
+Call = Tuple[str, str, Any, Any, Any]
+# send(call) -> (status, parsed json or None)
+Sender = Callable[[Call], Tuple[int, Any]]
+
+
+def _test_client_sender_factory() -> Callable[[], Sender]:
+    from .main import create_app
+
+    app = create_app()
+
+    def factory() -> Sender:
+        client = app.test_client()
+
+        def send(call: Call) -> Tuple[int, Any]:
+            method, path, body, text, ctype = call
+            kwargs: Dict[str, Any] = {}
+            if body is not None:
+                kwargs["json"] = body
+            elif text is not None:
+                kwargs["data"] = text
+                kwargs["content_type"] = ctype or "text/plain"
+            r = client.open(path, method=method, **kwargs)
+            try:
+                parsed = loads_bytes(r.data) if r.is_json else None
+            except Exception:
+                parsed = None
+            return r.status_code, parsed
+
+        return send
+
+    return factory
+
+
+def _http_sender_factory(base: str) -> Callable[[], Sender]:
+    base = base.rstrip("/")
+
+    def factory() -> Sender:
+        def send(call: Call) -> Tuple[int, Any]:
+            method, path, body, text, ctype = call
+            data = None
+            headers: Dict[str, str] = {}
+            if body is not None:
+                data = dumps_bytes(body)
+                headers["Content-Type"] = "application/json"
+            elif text is not None:
+                data = str(text).encode("utf-8")
+                headers["Content-Type"] = ctype or "text/plain"
+            req = urllib.request.Request(base + path, data=data, method=method, headers=headers)
+            try:
+                with urllib.request.urlopen(req, timeout=30) as r:
+                    raw = r.read()
+                    status = r.status
+                    is_json = "json" in (r.headers.get("Content-Type") or "")
+            except urllib.error.HTTPError as e:
+                return e.code, None
+            try:
+                parsed = loads_bytes(raw) if is_json else None
+            except Exception:
+                parsed = None
+            return status, parsed
+
+        return send
+
+    return factory
+
+
+def _route_resolver() -> Callable[[str, str], str]:
+    from werkzeug.exceptions import HTTPException
+
+    from .main import create_app
+
+    adapter = create_app().url_map.bind("localhost")
+    cache: Dict[Tuple[str, str], str] = {}
+
+    def resolve(method: str, path: str) -> str:
+        key = (method, path.split("?", 1)[0])
+        hit = cache.get(key)
+        if hit is None:
+            try:
+                rule, _ = adapter.match(key[1], method=method, return_rule=True)
+                hit = f"{method} {rule.rule}"
+            except HTTPException:
+                hit = f"{method} {key[1]}"
+            cache[key] = hit
+        return hit
+
+    return resolve
+
+
+def _percentile(sorted_ms: List[float], q: float) -> float:
+    if not sorted_ms:
+        return 0.0
+    # nearest rank
+    idx = min(len(sorted_ms) - 1, max(0, math.ceil(q / 100.0 * len(sorted_ms)) - 1))
+    return sorted_ms[idx]
+
+
+class Recorder:
+    def __init__(self, resolve: Callable[[str, str], str]) -> None:
+        self.resolve = resolve
+        self.samples: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+        self.lock = threading.Lock()
+
+    def timed(self, send: Sender, call: Call) -> Tuple[int, Any]:
+        t0 = time.perf_counter()
+        try:
+            status, parsed = send(call)
+        except Exception:
+            status, parsed = 599, None
+        ms = (time.perf_counter() - t0) * 1000
+        route = self.resolve(call[0], call[1])
+        with self.lock:
+            self.samples.setdefault(route, []).append(ms)
+            if status >= 500:
+                self.errors[route] = self.errors.get(route, 0) + 1
+        return status, parsed
+
+    def summary(self, wall: float) -> Dict[str, Dict[str, float]]:
+        out: Dict[str, Dict[str, float]] = {}
+        for route, ms in sorted(self.samples.items()):
+            s = sorted(ms)
+            out[route] = {
+                "count": len(s),
+                "errors": self.errors.get(route, 0),
+                "p50": round(_percentile(s, 50), 3),
+                "p95": round(_percentile(s, 95), 3),
+                "p99": round(_percentile(s, 99), 3),
+                "rps": round(len(s) / wall, 2) if wall > 0 else 0.0,
+            }
+        return out
+
+
+def _synthetic_client(send: Sender, rec: Recorder, ops: int, seed: int) -> None:
+    rnd = random.Random(seed)
+    _, data = rec.timed(send, ("GET", "/api/data", None, None, None))
+    ids = [n["id"] for n in (data or {}).get("nodes", []) if isinstance(n, dict) and isinstance(n.get("id"), str)]
+    for i in range(ops):
+        r = rnd.random()
+        if r < 0.4 or not ids:
+            _, data = rec.timed(send, ("GET", "/api/data", None, None, None))
+            if isinstance(data, dict):
+                ids = [n["id"] for n in data.get("nodes", []) if isinstance(n.get("id"), str)] or ids
+        elif r < 0.7:
+            moved = rnd.sample(ids, min(len(ids), rnd.randint(1, 5)))
+            body = [{"id": nid, "position": {"x": rnd.uniform(-800, 800), "y": rnd.uniform(-600, 600)}} for nid in moved]
+            rec.timed(send, ("POST", "/api/nodes/positions", body, None, None))
+        elif r < 0.9:
+            nid = rnd.choice(ids)
+            fields = [
+                {"key": "名称", "type": "text", "value": f"NPC-{seed}-{i}"},
+                {"key": "标签", "type": "tag", "value": rnd.choice(["NPC", "地点", "剧情"])},
+                {"key": "地点", "type": "text", "value": f"地点-{rnd.randint(0, 20)}"},
+            ]
+            rec.timed(send, ("PUT", f"/api/nodes/{nid}", {"fields": fields}, None, None))
+        else:
+            rec.timed(send, ("POST", "/api/undo", None, None, None))
+
+
+def _seed(send: Sender, nodes: int) -> None:
+    rnd = random.Random(0)
+    for i in range(nodes):
+        tag = rnd.choice(["NPC", "地点", "剧情"])
+        fields = [
+            {"key": "名称", "type": "text", "value": f"{tag}-{i}"},
+            {"key": "标签", "type": "tag", "value": tag},
+            {"key": "地点", "type": "text", "value": f"地点-{rnd.randint(0, 20)}"},
+        ]
+        send(("POST", "/api/nodes", {"fields": fields, "position": {"x": 0, "y": 0}}, None, None))
+
+
+def load_recording(path: str) -> List[Call]:
+    calls: List[Call] = []
+    with open(path, "rb") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                e = loads_bytes(line)
+            except Exception:
+                continue
+            if isinstance(e, dict) and isinstance(e.get("method"), str) and isinstance(e.get("path"), str):
+                calls.append((e["method"], e["path"], e.get("body"), e.get("text"), e.get("contentType")))
+    return calls
+
+
+def compare(current: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]], threshold: float) -> List[str]:
+    """Return a message per route whose p95 regressed beyond threshold x baseline."""
+    out: List[str] = []
+    for route, cur in current.items():
+        base = baseline.get(route)
+        if not base:
+            continue
+        b95 = float(base.get("p95", 0) or 0)
+        if b95 > 0 and cur["p95"] > b95 * threshold:
+            out.append(f"{route}: p95 {cur['p95']:.2f}ms > {threshold:.2f} x baseline {b95:.2f}ms")
+    return out
+
+
+# Module globals pointing the in-process app at its files, and the caches built from them
+_ISOLATED = (
+    ("storage", ("DATA_PATH", "TEMPLATES_PATH", "SQLITE_PATH", "_SQLITE", "_CACHE", "_REFS", "_TEMPLATES", "_TEMPLATES_MTIME")),
+    ("snapshots", ("SNAPSHOT_DIR",)),
+)
+
+
+def _isolate(tmpdir: str, data: str | None) -> Callable[[], None]:
+    """Point storage (json or sqlite) and snapshots at tmpdir; returns a restore function.
+
+    data, if given, is copied in as the starting data.json; templates are copied so
+    template routes see the real set without writing to it.
+    """
+    from . import snapshots, storage
+
+    mods = {"storage": storage, "snapshots": snapshots}
+    saved = [(mods[m], name, getattr(mods[m], name)) for m, names in _ISOLATED for name in names]
+    tmp_data = os.path.join(tmpdir, "data.json")
+    if data:
+        shutil.copyfile(data, tmp_data)
+    tmp_templates = os.path.join(tmpdir, "templates.json")
+    if os.path.exists(storage.TEMPLATES_PATH):
+        shutil.copyfile(storage.TEMPLATES_PATH, tmp_templates)
+    storage._flush_to_disk_safe()
+    storage.DATA_PATH = tmp_data
+    storage.TEMPLATES_PATH = tmp_templates
+    storage.SQLITE_PATH = os.path.join(tmpdir, "data.sqlite")
+    storage._SQLITE = storage._CACHE = storage._REFS = None
+    storage._TEMPLATES = storage._TEMPLATES_MTIME = None
+    snapshots.SNAPSHOT_DIR = os.path.join(tmpdir, "snapshots")
+
+    def restore() -> None:
+        storage._flush_to_disk_safe()
+        if storage._SQLITE is not None:
+            storage._SQLITE.close()
+        for mod, name, value in saved:
+            setattr(mod, name, value)
+
+    return restore
+
+
+def run(args: argparse.Namespace) -> int:
+    tmpdir = None
+    restore: Callable[[], None] | None = None
+    if args.target:
+        factory = _http_sender_factory(args.target)
+    else:
+        # Isolate the in-process run from the app's data, templates and database
+        tmpdir = tempfile.mkdtemp(prefix="loadtest-")
+        restore = _isolate(tmpdir, args.data)
+        factory = _test_client_sender_factory()
+
+    rec = Recorder(_route_resolver())
+    try:
+        if args.seed_nodes and not args.replay:
+            _seed(factory(), args.seed_nodes)
+        workers: List[threading.Thread] = []
+        if args.replay:
+            calls = load_recording(args.replay)
+            shards = [calls[i::args.clients] for i in range(args.clients)]
+
+            def replay(shard: List[Call]) -> None:
+                send = factory()
+                for c in shard:
+                    rec.timed(send, c)
+
+            workers = [threading.Thread(target=replay, args=(sh,)) for sh in shards]
+        else:
+            workers = [
+                threading.Thread(target=_synthetic_client, args=(factory(), rec, args.ops, i + 1))
+                for i in range(args.clients)
+            ]
+        t0 = time.perf_counter()
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+        wall = time.perf_counter() - t0
+    finally:
+        if restore is not None:
+            restore()
+        if tmpdir:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+    summary = rec.summary(wall)
+    total = sum(int(s["count"]) for s in summary.values())
+    print(f"{'route':<40} {'count':>6} {'err':>4} {'p50':>9} {'p95':>9} {'p99':>9} {'rps':>8}")
+    for route, s in summary.items():
+        print(f"{route:<40} {s['count']:>6} {s['errors']:>4} {s['p50']:>9.2f} {s['p95']:>9.2f} {s['p99']:>9.2f} {s['rps']:>8.2f}")
+    print(f"total {total} requests in {wall:.2f}s ({total / wall if wall > 0 else 0:.1f} req/s)")
+
+    if args.save_baseline:
+        with open(args.save_baseline, "wb") as f:
+            f.write(dumps_bytes(summary))
+    if args.baseline:
+        with open(args.baseline, "rb") as f:
+            baseline = loads_bytes(f.read()) or {}
+        regressions = compare(summary, baseline, args.threshold)
+        for msg in regressions:
+            print(f"REGRESSION {msg}")
+        if regressions:
+            return 1
+    return 0
+
+
+def main(argv: List[str] | None = None) -> int:
+    p = argparse.ArgumentParser(prog="python -m app.loadtest", description="Replay / load-test the API")
+    p.add_argument("--target", help="base URL of a running server; default drives an in-process test client")
+    p.add_argument("--data", help="data.json to start from (in-process mode only)")
+    p.add_argument("--replay", help="JSONL file recorded with RECORD_REQUESTS")
+    p.add_argument("--clients", type=int, default=4)
+    p.add_argument("--ops", type=int, default=100, help="operations per synthetic client")
+    p.add_argument("--seed-nodes", type=int, default=50, help="nodes to create before a synthetic run")
+    p.add_argument("--save-baseline", help="write the per-route summary to this file")
+    p.add_argument("--baseline", help="compare p95 against this saved summary")
+    p.add_argument("--threshold", type=float, default=1.25, help="allowed p95 ratio vs baseline")
+    args = p.parse_args(argv)
+    if args.clients < 1:
+        p.error("--clients must be >= 1")
+    return run(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
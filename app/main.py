@@ -1,51 +1,61 @@
 from __future__ import annotations
 
+import math
 import os
 from typing import Any, Dict, List
 from copy import deepcopy
 
-from flask import Flask, jsonify, request, send_from_directory
+from flask import Flask, Response, jsonify, request, send_from_directory
 from flask_cors import CORS
 
-from .storage import read_all, write_all, read_templates, write_templates, new_id
-from .utils import compute_auto_links, derive_node_style
+from .storage import (
+    read_all, read_versioned, write_all, read_templates, write_templates, new_id, read_with_refs, find_nodes,
+    indexed_auto_links,
+    current_state, snapshot_state, write_state, versioned_state,
+)
+from .compact import PackedDoc
+from .refs import RefChanges, compact_refs, pair_key, purge_node_refs
+from . import analytics, snapshots
+from .report import iter_markdown
+from .recorder import install_recorder
+from .utils import apply_field_values, compute_auto_links, derive_node_style, grid_positions, rule_b_links
 
 
 def create_app() -> Flask:
     app = Flask(__name__, static_folder="static", template_folder="static")
     CORS(app)
-
-    # In-memory history stacks for undo/redo (not persisted)
-    undo_stack: List[Dict[str, Any]] = []
-    redo_stack: List[Dict[str, Any]] = []
+    record_path = os.environ.get("RECORD_REQUESTS")
+    if record_path:
+        install_recorder(app, record_path)
+
+    # In-memory history stacks for undo/redo (not persisted); entries are packed
+    # documents that share unchanged nodes with the cache and with each other
+    undo_stack: List[PackedDoc] = []
+    redo_stack: List[PackedDoc] = []
     MAX_HISTORY = 100
+    MAX_BULK_NODES = 1000
 
-    def write_with_undo(new_data: Dict[str, Any], prev_data: Dict[str, Any]) -> None:
+    def write_with_undo(new_data: Dict[str, Any], prev_data: Dict[str, Any], refs: RefChanges | None = None) -> None:
         nonlocal undo_stack, redo_stack
         # push previous snapshot
-        undo_stack.append(deepcopy(prev_data))
+        undo_stack.append(snapshot_state(prev_data))
         if len(undo_stack) > MAX_HISTORY:
             undo_stack.pop(0)
         # any new mutation clears redo
         redo_stack.clear()
-        write_all(new_data)
-
-    @app.get("/")
-    def index():
-        # app.static_folder may be None in typing; default to 'static'
-        static_dir = app.static_folder or "static"
-        return send_from_directory(static_dir, "index.html")
-
-    @app.get("/api/data")
-    def get_data():
-        data = read_all()
-        nodes = data.get("nodes", [])
-        # add computed styles
-        for n in nodes:
-            n["style"] = derive_node_style(n)
-        field_filter = request.args.get("field")
-        filters = [field_filter] if field_filter else None
-        auto_links = compute_auto_links(nodes, filters)
+        write_all(new_data, refs)
+
+    def visible_auto_links(data: Dict[str, Any], filters: List[str] | None = None, doc: PackedDoc | None = None, gen: int | None = None) -> List[Dict[str, Any]]:
+        # Rule B auto links minus suppressed pairs, with curvature overrides applied.
+        # Given the packed state data was read from (see read_versioned), the sqlite
+        # backend answers from its index, otherwise the records' stored match keys are used
+        # (data then only needs the non-node keys, e.g. doc.rest).
+        auto_links = indexed_auto_links(gen, filters) if gen is not None else None
+        if auto_links is None:
+            if doc is not None:
+                auto_links = rule_b_links([r.id for r in doc.nodes], doc.match_keys(), filters)
+            else:
+                auto_links = compute_auto_links(data.get("nodes", []), filters)
         suppressed: set[tuple[str, str]] = set()
         for p in data.get("suppressedAutoPairs", []) or []:
             a = p.get("a"); b = p.get("b")
@@ -72,7 +82,24 @@ def create_app() -> Flask:
                         e["cpd"] = float(val)
                 except Exception:
                     pass
-        auto_links = filtered_auto
+        return filtered_auto
+
+    @app.get("/")
+    def index():
+        # app.static_folder may be None in typing; default to 'static'
+        static_dir = app.static_folder or "static"
+        return send_from_directory(static_dir, "index.html")
+
+    @app.get("/api/data")
+    def get_data():
+        data, doc, gen = read_versioned()
+        nodes = data.get("nodes", [])
+        # add computed styles
+        for n in nodes:
+            n["style"] = derive_node_style(n)
+        field_filter = request.args.get("field")
+        filters = [field_filter] if field_filter else None
+        auto_links = visible_auto_links(data, filters, doc, gen)
         return jsonify({
             "nodes": nodes,
             "links": data.get("links", []),
@@ -143,7 +170,7 @@ def create_app() -> Flask:
 
     @app.delete("/api/nodes/<node_id>")
     def delete_node(node_id: str):
-        data = read_all()
+        data, refs, changes = read_with_refs()
         prev = deepcopy(data)
         nodes: List[Dict[str, Any]] = data.get("nodes", [])
         before = len(nodes)
@@ -153,7 +180,10 @@ def create_app() -> Flask:
         links[:] = [l for l in links if l.get("source") != node_id and l.get("target") != node_id]
         if len(nodes) == before:
             return jsonify({"error": "not found"}), 404
-        write_with_undo(data, prev)
+        # cascade: group members, suppressed pairs and auto edge overrides
+        if refs.references(node_id):
+            purge_node_refs(data, {node_id}, refs, changes)
+        write_with_undo(data, prev, changes)
         return jsonify({"ok": True})
 
     # manual links
@@ -220,6 +250,55 @@ def create_app() -> Flask:
         write_templates(body)
         return jsonify({"ok": True})
 
+    # create N nodes from a named template as a single undoable mutation
+    @app.post("/api/templates/<name>/instantiate")
+    def instantiate_template(name: str):
+        body = request.get_json(force=True, silent=True) or {}
+        if not isinstance(body, dict):
+            return jsonify({"error": "invalid body"}), 400
+        tpl = read_templates().get(name)
+        if not isinstance(tpl, list):
+            return jsonify({"error": "template not found"}), 404
+        items = body.get("items") or []
+        if not isinstance(items, list):
+            return jsonify({"error": "invalid items"}), 400
+        try:
+            count = int(body.get("count", len(items) or 1))
+        except Exception:
+            return jsonify({"error": "invalid count"}), 400
+        try:
+            spacing = float(body.get("spacing", 120))
+        except Exception:
+            return jsonify({"error": "invalid spacing"}), 400
+        if not math.isfinite(spacing):
+            return jsonify({"error": "invalid spacing"}), 400
+        try:
+            columns = int(body["columns"]) if body.get("columns") is not None else None
+        except Exception:
+            return jsonify({"error": "invalid columns"}), 400
+        count = max(count, len(items))
+        if count <= 0 or count > MAX_BULK_NODES:
+            return jsonify({"error": "invalid count"}), 400
+        center = body.get("center")
+        positions = grid_positions(center, count, spacing, columns) if isinstance(center, dict) else [None] * count
+        data = read_all()
+        prev = deepcopy(data)
+        created: List[Dict[str, Any]] = []
+        for i in range(count):
+            item = items[i] if i < len(items) and isinstance(items[i], dict) else {}
+            values = item.get("values")
+            fields = apply_field_values(tpl, values if isinstance(values, dict) else {})
+            extra = item.get("fields")
+            if isinstance(extra, list):
+                fields.extend(f for f in extra if isinstance(f, dict))
+            pos = item.get("position") if isinstance(item.get("position"), dict) else positions[i]
+            created.append({"id": new_id(), "fields": fields, "position": pos})
+        data.setdefault("nodes", []).extend(created)
+        write_with_undo(data, prev)
+        for n in created:
+            n["style"] = derive_node_style(n)
+        return jsonify({"ok": True, "nodes": created})
+
     # import/export
     @app.post("/api/import/json")
     def import_json():
@@ -227,13 +306,15 @@ def create_app() -> Flask:
         if not isinstance(body, dict) or "nodes" not in body:
             return jsonify({"error": "invalid data"}), 400
         prev = read_all()
-        write_with_undo({
+        new_data = {
             "nodes": body.get("nodes", []),
             "links": body.get("links", []),
             "suppressedAutoPairs": body.get("suppressedAutoPairs", []),
             "autoEdgeOverrides": body.get("autoEdgeOverrides", {}),
             "groups": body.get("groups", []),
-        }, prev)
+        }
+        compact_refs(new_data)
+        write_with_undo(new_data, prev)
         return jsonify({"ok": True})
 
     @app.post("/api/import/csv")
@@ -274,13 +355,15 @@ def create_app() -> Flask:
         a = body.get("a"); b = body.get("b")
         if not isinstance(a, str) or not isinstance(b, str) or a == b:
             return jsonify({"error": "invalid pair"}), 400
-        data = read_all()
+        data, refs, changes = read_with_refs()
+        if refs.has_pair(a, b):
+            return jsonify({"ok": True})
         prev = deepcopy(data)
         pairs = data.setdefault("suppressedAutoPairs", [])
         key = (a, b) if a <= b else (b, a)
-        if not any(isinstance(p.get("a"), str) and isinstance(p.get("b"), str) and ((p.get("a"), p.get("b")) if p.get("a") <= p.get("b") else (p.get("b"), p.get("a"))) == key for p in pairs):
-            pairs.append({"a": key[0], "b": key[1]})
-            write_with_undo(data, prev)
+        pairs.append({"a": key[0], "b": key[1]})
+        changes.add_pair(key)
+        write_with_undo(data, prev, changes)
         return jsonify({"ok": True})
 
     @app.post("/api/auto/unsuppress")
@@ -289,18 +372,17 @@ def create_app() -> Flask:
         a = body.get("a"); b = body.get("b")
         if not isinstance(a, str) or not isinstance(b, str) or a == b:
             return jsonify({"error": "invalid pair"}), 400
-        data = read_all()
+        data, refs, changes = read_with_refs()
+        if not refs.has_pair(a, b):
+            return jsonify({"ok": True})
         prev = deepcopy(data)
         key = (a, b) if a <= b else (b, a)
         pairs = data.setdefault("suppressedAutoPairs", [])
         before = len(pairs)
-        def norm_pair(x: Any, y: Any) -> tuple[str, str] | None:
-            if isinstance(x, str) and isinstance(y, str):
-                return (x, y) if x <= y else (y, x)
-            return None
-        pairs[:] = [p for p in pairs if norm_pair(p.get("a"), p.get("b")) != key]
+        pairs[:] = [p for p in pairs if pair_key(p.get("a"), p.get("b")) != key]
         if len(pairs) != before:
-            write_with_undo(data, prev)
+            changes.remove_pair(key)
+            write_with_undo(data, prev, changes)
         return jsonify({"ok": True})
 
     # Undo/Redo endpoints
@@ -309,10 +391,9 @@ def create_app() -> Flask:
         nonlocal undo_stack, redo_stack
         if not undo_stack:
             return jsonify({"error": "nothing to undo"}), 400
-        current = read_all()
         state = undo_stack.pop()
-        redo_stack.append(deepcopy(current))
-        write_all(state)
+        redo_stack.append(current_state())
+        write_state(state)
         return jsonify({"ok": True})
 
     @app.post("/api/redo")
@@ -320,16 +401,99 @@ def create_app() -> Flask:
         nonlocal undo_stack, redo_stack
         if not redo_stack:
             return jsonify({"error": "nothing to redo"}), 400
-        current = read_all()
         state = redo_stack.pop()
-        undo_stack.append(deepcopy(current))
-        write_all(state)
+        undo_stack.append(current_state())
+        write_state(state)
         return jsonify({"ok": True})
 
     @app.get("/api/history")
     def api_history():
         return jsonify({"canUndo": len(undo_stack) > 0, "canRedo": len(redo_stack) > 0})
 
+    # content-addressed snapshots
+    @app.get("/api/snapshots")
+    def list_snapshots():
+        return jsonify(snapshots.list_snapshots())
+
+    @app.post("/api/snapshots")
+    def create_snapshot():
+        return jsonify(snapshots.create_snapshot(read_all(), "manual"))
+
+    @app.post("/api/snapshots/<sid>/restore")
+    def restore_snapshot(sid: str):
+        try:
+            restored = snapshots.load_snapshot(sid)
+        except Exception:
+            return jsonify({"error": "snapshot unreadable"}), 400
+        if restored is None:
+            return jsonify({"error": "not found"}), 404
+        if not isinstance(restored, dict) or "nodes" not in restored:
+            return jsonify({"error": "invalid data"}), 400
+        prev = read_all()
+        new_data = {
+            "nodes": restored.get("nodes", []),
+            "links": restored.get("links", []),
+            "suppressedAutoPairs": restored.get("suppressedAutoPairs", []),
+            "autoEdgeOverrides": restored.get("autoEdgeOverrides", {}),
+            "groups": restored.get("groups", []),
+        }
+        write_with_undo(new_data, prev)
+        return jsonify({"ok": True})
+
+    # graph analytics over manual + visible auto edges (index maintained incrementally)
+    @app.get("/api/analytics/components")
+    def analytics_components():
+        with analytics.synced(current_state()) as g:
+            comps = g.components()
+            isolated = g.isolated()
+            return jsonify({
+                "count": len(comps),
+                "components": [{"size": len(c), "nodes": [g.node_info(x) for x in c]} for c in comps if len(c) > 1],
+                "isolated": [g.node_info(x) for x in isolated],
+            })
+
+    @app.get("/api/analytics/hubs")
+    def analytics_hubs():
+        try:
+            limit = max(1, int(request.args.get("limit", "10")))
+        except Exception:
+            return jsonify({"error": "invalid limit"}), 400
+        tag = request.args.get("tag") or None
+        with analytics.synced(current_state()) as g:
+            return jsonify({"hubs": [g.node_info(x) for x in g.hubs(limit, tag)]})
+
+    @app.get("/api/analytics/path")
+    def analytics_path():
+        src = request.args.get("from"); dst = request.args.get("to")
+        if not src or not dst:
+            return jsonify({"error": "from and to required"}), 400
+        with analytics.synced(current_state()) as g:
+            if src not in g.recs or dst not in g.recs:
+                return jsonify({"error": "not found"}), 404
+            path = g.shortest_path(src, dst)
+            if path is None:
+                return jsonify({"path": None, "length": None})
+            return jsonify({"path": [g.node_info(x) for x in path], "length": len(path) - 1})
+
+    # drop references to nodes that no longer exist (groups, suppressed pairs, overrides)
+    @app.post("/api/maintenance/compact")
+    def api_compact():
+        data = read_all()
+        prev = deepcopy(data)
+        removed = compact_refs(data)
+        if any(removed.values()):
+            write_with_undo(data, prev)
+        return jsonify({"ok": True, "removed": removed})
+
+    # field search: ?key=地点&value=邮局 (either may be omitted)
+    @app.get("/api/search")
+    def search_nodes():
+        key = request.args.get("key")
+        value = request.args.get("value")
+        if key is None and value is None:
+            return jsonify({"error": "key or value required"}), 400
+        return jsonify({"ids": find_nodes(key, value)})
+
     @app.get("/api/auto/suppressed")
     def list_suppressed():
         data = read_all()
@@ -348,11 +512,12 @@ def create_app() -> Flask:
             cpd_val = float(cpd)
         except Exception:
             return jsonify({"error": "invalid cpd"}), 400
-        data = read_all()
+        data, _, changes = read_with_refs()
         prev = deepcopy(data)
         overrides = data.setdefault("autoEdgeOverrides", {})
         overrides[f"{s}->{t}"] = cpd_val
-        write_with_undo(data, prev)
+        changes.add_override(f"{s}->{t}")
+        write_with_undo(data, prev, changes)
         return jsonify({"ok": True})
 
     @app.get("/api/export/csv")
@@ -373,19 +538,10 @@ def create_app() -> Flask:
 
     @app.get("/api/export/md")
     def export_md():
-        data = read_all()
-        lines = ["# 节点清单\n"]
-        for n in data.get("nodes", []):
-            lines.append(f"## {n.get('id')}\n")
-            fields = n.get("fields", []) or []
-            for f in fields:
-                key = f.get("key", "")
-                typ = f.get("type", "")
-                val = f.get("value", "")
-                lines.append(f"- {key} ({typ}): {val}")
-            lines.append("")
-        payload = "\n".join(lines).encode("utf-8")
-        return (payload, 200, {"Content-Type": "text/markdown; charset=utf-8", "Content-Disposition": "attachment; filename=export.md"})
+        # Works on the packed state; auto links are computed only if some fragment needs rendering
+        doc, gen = versioned_state()
+        chunks = (part.encode("utf-8") for part in iter_markdown(doc, gen, lambda: visible_auto_links(doc.rest, None, doc, gen)))
+        return Response(chunks, 200, {"Content-Type": "text/markdown; charset=utf-8", "Content-Disposition": "attachment; filename=export.md"})
 
     # reset canvas: clear nodes, links and auto-related settings
     @app.post("/api/reset")
@@ -415,7 +571,7 @@ def create_app() -> Flask:
         members = body.get("members") or []
         if not isinstance(members, list):
             return jsonify({"error": "invalid members"}), 400
-        data = read_all()
+        data, _, changes = read_with_refs()
         prev = deepcopy(data)
         gid = new_id()
         color = body.get("color") or "#3b82f6"
@@ -426,13 +582,14 @@ def create_app() -> Flask:
             op = 0.08
         group = {"id": gid, "label": str(label), "members": [m for m in members if isinstance(m, str)], "color": str(color), "opacity": op}
         data.setdefault("groups", []).append(group)
-        write_with_undo(data, prev)
+        changes.set_group(gid, [], group["members"])
+        write_with_undo(data, prev, changes)
         return jsonify(group)
 
     @app.put("/api/groups/<gid>")
     def update_group(gid: str):
         body = request.get_json(force=True, silent=True) or {}
-        data = read_all()
+        data, _, changes = read_with_refs()
         prev = deepcopy(data)
         groups: List[Dict[str, Any]] = data.setdefault("groups", [])
         for g in groups:
@@ -441,6 +598,7 @@ def create_app() -> Flask:
                     g["label"] = str(body.get("label") or "")
                 if "members" in body and isinstance(body.get("members"), list):
                     mems = body.get("members") or []
+                    changes.set_group(gid, g.get("members"), [m for m in mems if isinstance(m, str)])
                     g["members"] = [m for m in mems if isinstance(m, str)]
                 if "color" in body:
                     g["color"] = str(body.get("color") or "#3b82f6")
@@ -451,20 +609,23 @@ def create_app() -> Flask:
                             g["opacity"] = float(val)
                     except Exception:
                         pass
-                write_with_undo(data, prev)
+                write_with_undo(data, prev, changes)
                 return jsonify(g)
         return jsonify({"error": "not found"}), 404
 
     @app.delete("/api/groups/<gid>")
     def delete_group(gid: str):
-        data = read_all()
+        data, _, changes = read_with_refs()
         prev = deepcopy(data)
         groups: List[Dict[str, Any]] = data.setdefault("groups", [])
         before = len(groups)
+        for g in groups:
+            if g.get("id") == gid:
+                changes.set_group(gid, g.get("members"), [])
         groups[:] = [g for g in groups if g.get("id") != gid]
         if len(groups) == before:
             return jsonify({"error": "not found"}), 404
-        write_with_undo(data, prev)
+        write_with_undo(data, prev, changes)
         return jsonify({"ok": True})
 
     return app
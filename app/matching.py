@@ -0,0 +1,257 @@
+from __future__ import annotations
+
+import os
+import re
+import sys
+import unicodedata
+from itertools import islice, repeat
+from typing import Any, Dict, Iterable, List, Sequence, Tuple
+
+try:  # optional traditional -> simplified mapping
+    import opencc as _opencc  # type: ignore
+except Exception:  # pragma: no cover
+    _opencc = None  # type: ignore
+
+
+# Normalization applied to Rule B match keys (field keys/values, tags, names).
+# MATCH_NORMALIZE is a comma list of: nfkc, casefold, space, t2s ("none" = exact).
+# t2s needs the optional `opencc` package and is skipped without it.
+DEFAULT_NORMALIZE = "nfkc,casefold,space"
+
+NAME_KEY = "名称"
+ALIAS_KEYS = ("名称列表", "别名", "aliases", "Aliases")
+
+_SPLIT_RE = re.compile(r"[,，;|\n\r\t]")
+_SPACE_RE = re.compile(r"\s+")
+
+_FLAGS: frozenset[str] = frozenset()
+_T2S: Any = None
+_NAME_KEY_N = NAME_KEY
+_ALIAS_KEYS_N: frozenset[str] = frozenset(ALIAS_KEYS)
+# Bumped by configure(); stored keys computed under an older setting are stale
+_VERSION = 0
+# stored_keys() result for fields whose match keys are the raw strings; replaced
+# by configure() so records stored under an older setting are recognized
+_CLEAN: Any = object()
+# Field keys and tags -> (match key, _NAME/_ALIAS/0): few distinct strings, so
+# kept for the whole setting
+_KEY_MEMO: Dict[str, Tuple[str, int]] = {}
+_NAME, _ALIAS = 1, 2
+
+
+def configure(spec: str | None = None) -> None:
+    """Set the normalization steps; stored keys are recomputed on next use."""
+    global _FLAGS, _T2S, _NAME_KEY_N, _ALIAS_KEYS_N, _VERSION, _CLEAN
+    if spec is None:
+        spec = os.environ.get("MATCH_NORMALIZE", DEFAULT_NORMALIZE)
+    flags = {x.strip().lower() for x in spec.split(",") if x.strip()}
+    flags.discard("none")
+    _T2S = None
+    if "t2s" in flags:
+        try:
+            _T2S = _opencc.OpenCC("t2s") if _opencc is not None else None
+        except Exception:
+            _T2S = None
+        if _T2S is None:
+            flags.discard("t2s")
+    _FLAGS = frozenset(flags)
+    _VERSION += 1
+    _CLEAN = object()
+    _KEY_MEMO.clear()
+    _NAME_KEY_N = match_key(NAME_KEY)
+    _ALIAS_KEYS_N = frozenset(match_key(k) for k in ALIAS_KEYS)
+
+
+def describe() -> str:
+    # Stable identifier of the active normalization, used to detect stale stored keys
+    return ",".join(sorted(_FLAGS)) or "none"
+
+
+def version() -> int:
+    return _VERSION
+
+
+def match_key(raw: str) -> str:
+    s = raw
+    if "nfkc" in _FLAGS:
+        s = unicodedata.normalize("NFKC", s)
+    if _T2S is not None:
+        s = _T2S.convert(s)
+    if "casefold" in _FLAGS:
+        s = s.casefold()
+    if "space" in _FLAGS:
+        s = _SPACE_RE.sub(" ", s)
+    return s.strip()
+
+
+def _key_info(raw: str) -> Tuple[str, int]:
+    info = _KEY_MEMO.get(raw)
+    if info is None:
+        mk = _interned(match_key(raw))
+        info = _KEY_MEMO[raw] = (mk, _NAME if mk == _NAME_KEY_N else _ALIAS if mk in _ALIAS_KEYS_N else 0)
+    return info
+
+
+def key_of(raw: str) -> str:
+    """match_key for field keys and tags, memoized."""
+    return _key_info(raw)[0]
+
+
+def split_names(raw: str) -> Tuple[Tuple[str, str], ...]:
+    """Split an alias list once: ((display name, match key), ...)."""
+    out: List[Tuple[str, str]] = []
+    for p in _SPLIT_RE.split(raw):
+        p = p.strip()
+        if p:
+            out.append((p, match_key(p)))
+    return tuple(out)
+
+
+def is_name_key(key: Any) -> bool:
+    return isinstance(key, str) and _key_info(key)[1] == _NAME
+
+
+def is_alias_key(key: Any) -> bool:
+    return isinstance(key, str) and _key_info(key)[1] == _ALIAS
+
+
+def node_names(fields: List[Dict[str, Any]]) -> List[Tuple[str, str]]:
+    """Names used for Rule B: all 名称 text fields plus split alias lists.
+
+    Returns (display name, match key) pairs, deduplicated by match key.
+    """
+    names: List[Tuple[str, str]] = []
+    seen: set[str] = set()
+    for f in fields:
+        v = f.get("value")
+        if f.get("type") != "text" or not isinstance(v, str):
+            continue
+        k = f.get("key")
+        if is_name_key(k):
+            parts: Tuple[Tuple[str, str], ...] = ((v.strip(), match_key(v)),) if v.strip() else ()
+        elif is_alias_key(k):
+            parts = split_names(v)
+        else:
+            continue
+        for disp, mk in parts:
+            if mk and mk not in seen:
+                seen.add(mk)
+                names.append((disp, mk))
+    return names
+
+
+def _interned(s: str) -> str:
+    # keys and tags repeat across nodes; long free-text values do not
+    return sys.intern(s) if len(s) <= 32 else s
+
+
+def _field_kv(f: Any, types: Sequence[str]) -> Tuple[Any, Any, Any]:
+    # (key, type, value) of a packed (key, type code, value) tuple or a JSON field
+    if type(f) is tuple:
+        k, t, v = f
+        return k, types[t] if type(t) is int else t, v
+    if isinstance(f, dict):
+        return f.get("key"), f.get("type"), f.get("value")
+    return None, None, None
+
+
+def stored_keys(fields: Sequence[Any], types: Sequence[str] = ()) -> Any:
+    """The part of a node's match keys worth keeping with its fields.
+
+    Only what cannot be read off the raw strings is kept: a tuple
+    (version, x0, x1, ...) aligned with the fields, where x is None when the
+    value is its own match key, else the value's match key, or for alias lists
+    (value match key, split names). Nodes needing none of it, the common case,
+    share the _CLEAN marker. Field keys and tags go through key_of() instead.
+    """
+    out: List[Any] = [_VERSION]
+    clean = True
+    for f in fields:
+        k, t, v = _field_kv(f, types)
+        x: Any = None
+        if isinstance(v, str):
+            mv = match_key(v)
+            if mv != v:
+                x = _interned(mv)
+            if t == "text" and is_alias_key(k):
+                x = (mv, split_names(v))
+        out.append(x)
+        clean = clean and x is None
+    return _CLEAN if clean else tuple(out)
+
+
+def is_current(stored: Any) -> bool:
+    return stored is _CLEAN or (isinstance(stored, tuple) and stored[0] == _VERSION)
+
+
+class NodeKeys:
+    """Rule B match keys of one node, read off its fields.
+
+    pairs():      (key, value) match keys of every string field, in field order
+    names_tags(): node_names() result, (display name, match key), and
+                  (raw tag, match key) of every non-empty tag field
+
+    fields are JSON field dicts or packed field tuples (type codes index types).
+    With their stored_keys() nothing is normalized or split again. Records keep
+    only that stored form; this view holds no keys of its own.
+    """
+
+    __slots__ = ("fields", "stored", "types")
+
+    def __init__(self, fields: Any, stored: Any = None, types: Sequence[str] = ()) -> None:
+        self.fields = fields if isinstance(fields, (list, tuple)) else ()
+        self.types = types
+        self.stored = stored if is_current(stored) else stored_keys(self.fields, types)
+
+    def _with_stored(self) -> Iterable[Tuple[Any, Any]]:
+        stored = self.stored
+        return zip(self.fields, repeat(None) if stored is _CLEAN else islice(stored, 1, None))
+
+    def pairs(self) -> List[Tuple[str, str]]:
+        memo = _KEY_MEMO
+        types = self.types
+        out: List[Tuple[str, str]] = []
+        for f, x in self._with_stored():
+            k, _, v = f if type(f) is tuple else _field_kv(f, types)
+            if isinstance(k, str) and isinstance(v, str):
+                out.append(((memo.get(k) or _key_info(k))[0], v if x is None else x if type(x) is str else x[0]))
+        return out
+
+    def names_tags(self) -> Tuple[List[Tuple[str, str]], List[Tuple[str, str]]]:
+        memo = _KEY_MEMO
+        types = self.types
+        names: List[Tuple[str, str]] = []
+        tags: List[Tuple[str, str]] = []
+        seen: set[str] = set()
+        for f, x in self._with_stored():
+            if type(f) is tuple:
+                k, t, v = f
+                if type(t) is int:
+                    t = types[t]
+            else:
+                k, t, v = _field_kv(f, types)
+            if not isinstance(v, str):
+                continue
+            if t == "tag":
+                if v:
+                    tags.append((v, (memo.get(v) or _key_info(v))[0]))
+                continue
+            if t != "text" or not isinstance(k, str):
+                continue
+            kind = (memo.get(k) or _key_info(k))[1]
+            if kind == _NAME:
+                name = v.strip()
+                parts: Tuple[Tuple[str, str], ...] = ((name, v if x is None else x),) if name else ()
+            elif kind == _ALIAS:
+                parts = x[1]
+            else:
+                continue
+            # same names as node_names()
+            for disp, nk in parts:
+                if nk and nk not in seen:
+                    seen.add(nk)
+                    names.append((disp, nk))
+        return names, tags
+
+
+configure()
@@ -0,0 +1,55 @@
+from __future__ import annotations
+
+import threading
+import time
+from typing import Any, Dict
+
+from flask import Flask, g, request
+
+from .storage import dumps_bytes, loads_bytes
+
+# Optional request recorder: appends one JSON line per /api call with timing.
+# Enabled by RECORD_REQUESTS=<path.jsonl>; replay with `python -m app.loadtest --replay <path>`.
+
+MAX_BODY_BYTES = 64 * 1024
+
+
+def install_recorder(app: Flask, path: str) -> None:
+    lock = threading.Lock()
+
+    @app.before_request
+    def _rec_start():
+        # Buffer small bodies up front so handlers reading with cache=False still leave them for us
+        if (request.content_length or 0) <= MAX_BODY_BYTES:
+            request.get_data(cache=True)
+        g._rec_t0 = time.perf_counter()
+
+    @app.after_request
+    def _rec_finish(response):
+        t0 = getattr(g, "_rec_t0", None)
+        if t0 is None or not request.path.startswith("/api/"):
+            return response
+        entry: Dict[str, Any] = {
+            "ts": time.time(),
+            "method": request.method,
+            "path": request.full_path.rstrip("?"),
+            "route": request.url_rule.rule if request.url_rule is not None else None,
+            "status": response.status_code,
+            "ms": round((time.perf_counter() - t0) * 1000, 3),
+        }
+        raw = request.get_data(cache=True) if (request.content_length or 0) <= MAX_BODY_BYTES else b""
+        if raw:
+            try:
+                if not request.is_json:
+                    raise ValueError
+                entry["body"] = loads_bytes(raw)
+            except Exception:
+                entry["text"] = raw.decode("utf-8", errors="replace")
+            entry["contentType"] = request.content_type
+        line = dumps_bytes(entry) + b"\n"
+        try:
+            with lock, open(path, "ab") as f:
+                f.write(line)
+        except Exception:
+            pass
+        return response
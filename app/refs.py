@@ -0,0 +1,237 @@
+from __future__ import annotations
+
+from typing import Any, Callable, Dict, List, Set, Tuple
+
+
+Pair = Tuple[str, str]
+
+
+def pair_key(a: Any, b: Any) -> Pair | None:
+    # 顺序无关的节点对键；非字符串返回 None
+    if isinstance(a, str) and isinstance(b, str):
+        return (a, b) if a <= b else (b, a)
+    return None
+
+
+def split_override_key(key: Any) -> Pair | None:
+    # autoEdgeOverrides 的键形如 "<source>-><target>"
+    if not isinstance(key, str):
+        return None
+    s, sep, t = key.partition("->")
+    if not sep or not s or not t:
+        return None
+    return (s, t)
+
+
+class RefIndex:
+    """Reverse indexes from node id to the records that reference it.
+
+    Covers group members, suppressed auto pairs and auto edge overrides, so
+    lookups and duplicate checks do not have to scan those lists. Mutation paths
+    keep it current with the add_/remove_ methods instead of rebuilding it; the
+    shared index in storage only through RefChanges applied with the write.
+    """
+
+    def __init__(self) -> None:
+        self.groups_by_node: Dict[str, Set[str]] = {}
+        self.pairs_by_node: Dict[str, Set[Pair]] = {}
+        self.overrides_by_node: Dict[str, Set[str]] = {}
+        self.pairs: Set[Pair] = set()
+
+    @classmethod
+    def build(cls, data: Dict[str, Any]) -> "RefIndex":
+        idx = cls()
+        for g in data.get("groups", []) or []:
+            gid = g.get("id")
+            if not isinstance(gid, str):
+                continue
+            for m in g.get("members", []) or []:
+                if isinstance(m, str):
+                    idx.groups_by_node.setdefault(m, set()).add(gid)
+        for p in data.get("suppressedAutoPairs", []) or []:
+            key = pair_key(p.get("a"), p.get("b"))
+            if key is not None:
+                idx.add_pair(key)
+        for k in (data.get("autoEdgeOverrides", {}) or {}):
+            ends = split_override_key(k)
+            if ends is None:
+                continue
+            idx.add_override(k)
+        return idx
+
+    def add_pair(self, key: Pair) -> None:
+        self.pairs.add(key)
+        for nid in key:
+            self.pairs_by_node.setdefault(nid, set()).add(key)
+
+    def remove_pair(self, key: Pair) -> None:
+        self.pairs.discard(key)
+        for nid in key:
+            _discard(self.pairs_by_node, nid, key)
+
+    def add_override(self, key: str) -> None:
+        ends = split_override_key(key)
+        if ends is not None:
+            for nid in ends:
+                self.overrides_by_node.setdefault(nid, set()).add(key)
+
+    def remove_override(self, key: str) -> None:
+        ends = split_override_key(key)
+        if ends is not None:
+            for nid in ends:
+                _discard(self.overrides_by_node, nid, key)
+
+    def set_group(self, gid: str, old_members: Any, new_members: Any) -> None:
+        """Record that group gid's members changed from old_members to new_members."""
+        old = {m for m in old_members or [] if isinstance(m, str)}
+        new = {m for m in new_members or [] if isinstance(m, str)}
+        for m in old - new:
+            _discard(self.groups_by_node, m, gid)
+        for m in new - old:
+            self.groups_by_node.setdefault(m, set()).add(gid)
+
+    def drop_node(self, nid: str) -> None:
+        """Forget nid's group memberships (its groups no longer list it)."""
+        self.groups_by_node.pop(nid, None)
+
+    def has_pair(self, a: Any, b: Any) -> bool:
+        key = pair_key(a, b)
+        return key is not None and key in self.pairs
+
+    def references(self, node_id: str) -> bool:
+        return bool(
+            self.groups_by_node.get(node_id)
+            or self.pairs_by_node.get(node_id)
+            or self.overrides_by_node.get(node_id)
+        )
+
+
+class RefChanges:
+    """RefIndex updates recorded by one mutation, to apply together with its write.
+
+    Has the index's mutator methods. gen is the storage generation the mutation
+    read; storage.write_state applies the changes under its lock only if no other
+    write came in between, so the shared index never runs ahead of the cache.
+    """
+
+    def __init__(self, gen: int) -> None:
+        self.gen = gen
+        self._ops: List[Tuple[Callable[..., None], Tuple[Any, ...]]] = []
+
+    def add_pair(self, key: Pair) -> None:
+        self._ops.append((RefIndex.add_pair, (key,)))
+
+    def remove_pair(self, key: Pair) -> None:
+        self._ops.append((RefIndex.remove_pair, (key,)))
+
+    def add_override(self, key: str) -> None:
+        self._ops.append((RefIndex.add_override, (key,)))
+
+    def remove_override(self, key: str) -> None:
+        self._ops.append((RefIndex.remove_override, (key,)))
+
+    def set_group(self, gid: str, old_members: Any, new_members: Any) -> None:
+        # copied: the member lists belong to data the caller keeps editing
+        self._ops.append((RefIndex.set_group, (gid, list(old_members or []), list(new_members or []))))
+
+    def drop_node(self, nid: str) -> None:
+        self._ops.append((RefIndex.drop_node, (nid,)))
+
+    def apply(self, index: RefIndex) -> None:
+        for fn, args in self._ops:
+            fn(index, *args)
+
+
+def _discard(mapping: Dict[str, Set[Any]], nid: str, value: Any) -> None:
+    refs = mapping.get(nid)
+    if refs is not None:
+        refs.discard(value)
+        if not refs:
+            del mapping[nid]
+
+
+def purge_node_refs(data: Dict[str, Any], node_ids: Set[str], index: RefIndex | None = None, changes: RefChanges | None = None) -> Dict[str, int]:
+    """Remove group members, suppressed pairs and overrides pointing at node_ids.
+
+    Mutates data in place and returns per-kind removal counts. With an index,
+    only the records it lists for node_ids are touched, and the index is updated
+    to match, or changes records the updates if given (index is then only read).
+    """
+    removed = {"members": 0, "suppressedAutoPairs": 0, "autoEdgeOverrides": 0}
+    if not node_ids:
+        return removed
+    if index is None:
+        index = RefIndex.build(data)
+    gids: Set[str] = set()
+    pairs: Set[Pair] = set()
+    okeys: Set[str] = set()
+    for nid in node_ids:
+        gids |= index.groups_by_node.get(nid, set())
+        pairs |= index.pairs_by_node.get(nid, set())
+        okeys |= index.overrides_by_node.get(nid, set())
+
+    if gids:
+        for g in data.get("groups", []) or []:
+            if g.get("id") not in gids:
+                continue
+            members = g.get("members", []) or []
+            kept = [m for m in members if m not in node_ids]
+            removed["members"] += len(members) - len(kept)
+            g["members"] = kept
+    if pairs:
+        plist: List[Dict[str, Any]] = data.get("suppressedAutoPairs", []) or []
+        before = len(plist)
+        plist[:] = [p for p in plist if pair_key(p.get("a"), p.get("b")) not in pairs]
+        removed["suppressedAutoPairs"] = before - len(plist)
+    if okeys:
+        overrides: Dict[str, Any] = data.get("autoEdgeOverrides", {}) or {}
+        for k in okeys:
+            if overrides.pop(k, None) is not None:
+                removed["autoEdgeOverrides"] += 1
+    sink: RefIndex | RefChanges = changes if changes is not None else index
+    for nid in node_ids:
+        sink.drop_node(nid)
+    for key in pairs:
+        sink.remove_pair(key)
+    for k in okeys:
+        sink.remove_override(k)
+    return removed
+
+
+def compact_refs(data: Dict[str, Any]) -> Dict[str, int]:
+    """One-shot cleanup of references to nodes that no longer exist.
+
+    Also drops duplicate suppressed pairs and malformed entries. Mutates data
+    in place and returns per-kind removal counts.
+    """
+    alive = {n.get("id") for n in data.get("nodes", []) or [] if isinstance(n.get("id"), str)}
+    index = RefIndex.build(data)
+    dead: Set[str] = set()
+    for mapping in (index.groups_by_node, index.pairs_by_node, index.overrides_by_node):
+        dead.update(nid for nid in mapping if nid not in alive)
+    removed = purge_node_refs(data, dead, index)
+
+    # 去重 / 丢弃格式错误的条目
+    plist = data.get("suppressedAutoPairs")
+    if isinstance(plist, list):
+        seen: Set[Pair] = set()
+        kept: List[Dict[str, Any]] = []
+        for p in plist:
+            key = pair_key(p.get("a"), p.get("b")) if isinstance(p, dict) else None
+            if key is None or key[0] == key[1] or key in seen:
+                continue
+            seen.add(key)
+            kept.append({"a": key[0], "b": key[1]})
+        removed["suppressedAutoPairs"] += len(plist) - len(kept)
+        plist[:] = kept
+    overrides = data.get("autoEdgeOverrides")
+    if isinstance(overrides, dict):
+        for k in [k for k in overrides if split_override_key(k) is None]:
+            overrides.pop(k, None)
+            removed["autoEdgeOverrides"] += 1
+    for g in data.get("groups", []) or []:
+        members = g.get("members", []) or []
+        kept_m = list(dict.fromkeys(m for m in members if isinstance(m, str)))
+        removed["members"] += len(members) - len(kept_m)
+        g["members"] = kept_m
+    return removed
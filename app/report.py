@@ -0,0 +1,301 @@
+from __future__ import annotations
+
+import threading
+from typing import Any, Callable, Dict, Iterator, List, Set, Tuple
+
+from slugify import slugify
+
+from . import matching
+from .compact import NodeRec, PackedDoc
+from .storage import add_write_listener
+
+
+# Per-node fragment cache: node id -> (rendered markdown, ids it links to).
+# Fragments are valid for _DOC only. Every write hands the old and new state to
+# invalidate(), which drops the fragments of changed nodes and their neighbours,
+# so an export re-renders just those and reuses the rest as is. Nodes that gain
+# an auto edge to a changed node are only known once the auto links are computed,
+# so those are dropped by the next export (see _PENDING).
+_FRAGMENTS: Dict[str, Tuple[str, Tuple[str, ...]]] = {}
+_MENTIONS: Dict[str, Set[str]] = {}  # id -> nodes whose fragment links to it
+_PENDING: Set[Any] = set()  # ids changed since the fragments were rendered
+_DOC: PackedDoc | None = None
+_GEN = 0
+_MATCH_VERSION = -1
+_AUTO_COUNT: int | None = None  # visible auto links of _DOC, for the header
+# Title and tags per node, valid while the node keeps the same record
+_META: Dict[str, Tuple[NodeRec, str, List[str]]] = {}
+_FRAGMENTS_LOCK = threading.Lock()
+
+UNTAGGED = "未分类"
+# Above this share of changed nodes, clearing everything is cheaper than tracking neighbours
+_CLEAR_RATIO = 0.25
+
+
+def node_title(node: Dict[str, Any]) -> str:
+    for f in node.get("fields", []) or []:
+        if f.get("key") == "名称" and isinstance(f.get("value"), str) and f.get("value").strip():
+            return f.get("value").strip()
+    return str(node.get("id", ""))
+
+
+def node_tags(node: Dict[str, Any]) -> List[str]:
+    return [f.get("value") for f in node.get("fields", []) or [] if f.get("type") == "tag" and isinstance(f.get("value"), str) and f.get("value")]
+
+
+def _anchor(nid: str) -> str:
+    return f"node-{nid}"
+
+
+def _tag_anchors(tags: List[str]) -> Dict[str, str]:
+    # Slugs are ASCII (地点 -> di-dian) and can collide (NPC / npc), so later ones get a suffix
+    out: Dict[str, str] = {}
+    used: Set[str] = set()
+    for tag in tags:
+        base = f"tag-{slugify(tag) or 'section'}"
+        anchor, i = base, 2
+        while anchor in used:
+            anchor, i = f"{base}-{i}", i + 1
+        used.add(anchor)
+        out[tag] = anchor
+    return out
+
+
+def _related(links: List[Dict[str, Any]], auto_links: List[Dict[str, Any]]) -> Dict[str, List[Tuple[str, str, str]]]:
+    # node id -> [(kind, other id, label)]
+    rel: Dict[str, List[Tuple[str, str, str]]] = {}
+    for kind, edges in (("manual", links), ("auto", auto_links)):
+        for e in edges:
+            s = e.get("source"); t = e.get("target")
+            if not isinstance(s, str) or not isinstance(t, str):
+                continue
+            label = e.get("label") if isinstance(e.get("label"), str) else ""
+            rel.setdefault(s, []).append((kind, t, label))
+            if t != s:
+                rel.setdefault(t, []).append((kind, s, label))
+    return rel
+
+
+def _render_node(node: Dict[str, Any], title: str, related: List[Tuple[str, str, str, str]]) -> str:
+    # The anchor is emitted by iter_markdown, once per node
+    lines = [f"### {title}", ""]
+    for f in node.get("fields", []) or []:
+        lines.append(f"- {f.get('key', '')} ({f.get('type', '')}): {f.get('value', '')}")
+    if related:
+        lines.append("")
+        lines.append("**相关节点**")
+        lines.append("")
+        for kind, oid, otitle, label in related:
+            mark = "手动" if kind == "manual" else "自动"
+            suffix = f" — {label}" if label else ""
+            lines.append(f"- [{otitle}](#{_anchor(oid)})（{mark}）{suffix}")
+    lines.append("")
+    return "\n".join(lines) + "\n"
+
+
+def _meta(rec: NodeRec) -> Tuple[str, List[str]]:
+    hit = _META.get(rec.id)
+    if hit is not None and hit[0] is rec:
+        return hit[1], hit[2]
+    n = rec.unpack()
+    title, tags = node_title(n), node_tags(n)
+    _META[rec.id] = (rec, title, tags)
+    return title, tags
+
+
+# --- invalidation ---------------------------------------------------------------
+def _clear(doc: PackedDoc | None, gen: int) -> None:
+    # Caller must hold _FRAGMENTS_LOCK
+    global _DOC, _GEN, _MATCH_VERSION, _AUTO_COUNT
+    _FRAGMENTS.clear()
+    _MENTIONS.clear()
+    _PENDING.clear()
+    _DOC, _GEN, _MATCH_VERSION, _AUTO_COUNT = doc, gen, matching.version(), None
+
+
+def _drop(nid: str) -> None:
+    # Caller must hold _FRAGMENTS_LOCK
+    hit = _FRAGMENTS.pop(nid, None)
+    if hit is None:
+        return
+    for oid in hit[1]:
+        users = _MENTIONS.get(oid)
+        if users is not None:
+            users.discard(nid)
+            if not users:
+                del _MENTIONS[oid]
+
+
+def _same_content(a: NodeRec, b: NodeRec) -> bool:
+    # Positions and styling are not part of the report; repr tells 1 from 1.0 and True
+    return a.fields == b.fields and repr(a.fields) == repr(b.fields)
+
+
+def _changed_nodes(old: PackedDoc, new: PackedDoc) -> Set[Any] | None:
+    """Ids whose report content changed, or None if the section order may have changed."""
+    if len(old.nodes) == len(new.nodes):
+        changed: Set[Any] = set()
+        for a, b in zip(old.nodes, new.nodes):
+            if a is b:
+                continue
+            if a.id != b.id:
+                break
+            if not _same_content(a, b):
+                changed.add(a.id)
+        else:
+            return changed
+    before = {r.id: r for r in old.nodes}
+    after = {r.id: r for r in new.nodes}
+    if len(before) != len(old.nodes) or len(after) != len(new.nodes):
+        return None  # duplicate ids
+    if [i for i in before if i in after] != [i for i in after if i in before]:
+        return None
+    changed = set(before.keys() ^ after.keys())
+    changed.update(i for i, r in after.items() if i in before and before[i] is not r and not _same_content(before[i], r))
+    return changed
+
+
+def _manual_edges(rest: Dict[str, Any]) -> Dict[str, List[Tuple[str, str]]]:
+    return {nid: [(oid, label) for kind, oid, label in rel] for nid, rel in _related(rest.get("links", []) or [], []).items()}
+
+
+def _suppressed(rest: Dict[str, Any]) -> Set[Tuple[Any, Any]]:
+    return {(p.get("a"), p.get("b")) for p in rest.get("suppressedAutoPairs", []) or [] if isinstance(p, dict)}
+
+
+def _dirty_nodes(old: PackedDoc, new: PackedDoc) -> Tuple[Set[Any], Set[Any]] | None:
+    """(fragments to drop now, changed ids), or None to clear everything."""
+    changed = _changed_nodes(old, new)
+    if changed is None or len(changed) > len(new.nodes) * _CLEAR_RATIO:
+        return None
+    dirty = set(changed)
+    for x in changed:
+        dirty.update(_MENTIONS.get(x, ()))
+    if old.rest.get("links") != new.rest.get("links"):
+        before, after = _manual_edges(old.rest), _manual_edges(new.rest)
+        dirty.update(x for x in before.keys() | after.keys() if before.get(x) != after.get(x))
+    for a, b in _suppressed(old.rest) ^ _suppressed(new.rest):
+        dirty.update((a, b))
+    return dirty, changed
+
+
+def invalidate(old: PackedDoc | None, new: PackedDoc, gen: int) -> None:
+    """Write listener: drop the fragments the change from old to new affects."""
+    global _DOC, _GEN, _AUTO_COUNT
+    with _FRAGMENTS_LOCK:
+        if old is None or old is not _DOC or matching.version() != _MATCH_VERSION:
+            _clear(new, gen)
+            return
+        if _FRAGMENTS:
+            try:
+                found = _dirty_nodes(old, new)
+            except Exception:
+                found = None
+            if found is None:
+                _clear(new, gen)
+                return
+            dirty, changed = found
+            for nid in dirty:
+                _drop(nid)
+            _PENDING.update(changed)
+            if dirty:
+                _AUTO_COUNT = None
+        else:
+            _AUTO_COUNT = None
+        _DOC, _GEN = new, gen
+
+
+add_write_listener(invalidate)
+
+
+# --- export ---------------------------------------------------------------------
+def iter_markdown(doc: PackedDoc, gen: int, auto_links_fn: Callable[[], List[Dict[str, Any]]]) -> Iterator[str]:
+    """Yield the session report piece by piece: tag sections, then groups.
+
+    doc/gen come from storage.versioned_state(); auto_links_fn returns the visible
+    auto links of doc and is called only if some fragment has to be rendered.
+    """
+    global _AUTO_COUNT
+    recs: Dict[str, NodeRec] = {}
+    sections: Dict[str, List[str]] = {}
+    titles: Dict[str, str] = {}
+    with _FRAGMENTS_LOCK:
+        for rec in doc.nodes:
+            if isinstance(rec.id, str) and rec.id not in recs:
+                recs[rec.id] = rec
+                titles[rec.id], tags = _meta(rec)
+                for tag in (tags or [UNTAGGED]):
+                    sections.setdefault(tag, []).append(rec.id)
+        for nid in [k for k in _META if k not in recs]:
+            del _META[nid]
+        if doc is not _DOC and gen >= _GEN:
+            _clear(doc, gen)  # state replaced without a write (first load, reload)
+        if matching.version() != _MATCH_VERSION:
+            _clear(_DOC, _GEN)
+        cached = doc is _DOC
+        fragments = {nid: _FRAGMENTS[nid][0] for nid in recs if nid in _FRAGMENTS} if cached else {}
+        auto_count = _AUTO_COUNT if cached else None
+        pending = set(_PENDING) if cached else set()
+    # 未分类放最后
+    order = [t for t in sections if t != UNTAGGED] + ([UNTAGGED] if UNTAGGED in sections else [])
+    links = doc.rest.get("links", []) or []
+
+    rel: Dict[str, List[Tuple[str, str, str]]] = {}
+    if auto_count is None or len(fragments) < len(recs) or pending:
+        auto_links = auto_links_fn()
+        auto_count = len(auto_links)
+        rel = _related(links, auto_links)
+        # Neighbours of nodes changed since the last export: those that gained an
+        # auto edge to one still have a fragment without it
+        gained = {oid for x in pending for _, oid, _ in rel.get(x, ())}
+        with _FRAGMENTS_LOCK:
+            if doc is _DOC:
+                for nid in gained:
+                    _drop(nid)
+                _PENDING.difference_update(pending)
+        for nid in gained:
+            fragments.pop(nid, None)
+
+    yield "# 备团报告\n\n"
+    yield f"节点 {len(recs)} 个，手动关联 {len(links)} 条，自动关联 {auto_count} 条。\n\n"
+    anchors = _tag_anchors(order)
+    for tag in order:
+        yield f"- [{tag}](#{anchors[tag]})（{len(sections[tag])}）\n"
+    yield "\n"
+
+    rendered: Dict[str, Tuple[str, Tuple[str, ...]]] = {}
+    try:
+        emitted: Set[str] = set()
+        for tag in order:
+            yield f'<a id="{anchors[tag]}"></a>\n\n## {tag}\n\n'
+            for nid in sections[tag]:
+                text = fragments.get(nid)
+                if text is None:
+                    related = [(kind, oid, titles.get(oid, oid), label) for kind, oid, label in rel.get(nid, [])]
+                    text = _render_node(recs[nid].unpack(), titles[nid], related)
+                    fragments[nid] = text
+                    rendered[nid] = (text, tuple({oid for _, oid, _, _ in related}))
+                if nid not in emitted:
+                    emitted.add(nid)
+                    yield f'<a id="{_anchor(nid)}"></a>\n'
+                yield text
+    finally:
+        with _FRAGMENTS_LOCK:
+            # A write since versioned_state() already dropped what it affects
+            if doc is _DOC:
+                _AUTO_COUNT = auto_count
+                for nid, hit in rendered.items():
+                    _drop(nid)
+                    _FRAGMENTS[nid] = hit
+                    for oid in hit[1]:
+                        _MENTIONS.setdefault(oid, set()).add(nid)
+
+    groups = doc.rest.get("groups", []) or []
+    if groups:
+        yield "## 编组\n\n"
+        for g in groups:
+            yield f"### {g.get('label', '')}\n\n"
+            for m in g.get("members", []) or []:
+                if m in titles:
+                    yield f"- [{titles[m]}](#{_anchor(m)})\n"
+            yield "\n"
@@ -0,0 +1,310 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Set, Tuple
+
+# Content-addressed snapshot store:
+#   <SNAPSHOT_DIR>/chunks/<h[:2]>/<h>   one canonical-JSON record, list chunk or raw blob
+#   <SNAPSHOT_DIR>/manifests/<id>.json  one list root hash per section
+# Each section is stored as its records plus a tree of list chunks
+# ({"d": depth, "h": [hashes]}) over their ordered hashes. List chunk boundaries
+# depend on the hashes themselves, so an edit only rewrites the chunks around it.
+# Unchanged records and sections hash to the same chunks, and snapshots share
+# storage: a snapshot costs roughly the size of what changed.
+
+SNAPSHOT_DIR = os.environ.get("SNAPSHOT_DIR") or os.path.join(os.path.dirname(__file__), "snapshots")
+SNAPSHOT_INTERVAL = float(os.environ.get("SNAPSHOT_INTERVAL_SEC", "3600"))  # seconds, 0 disables
+KEEP_LAST = int(os.environ.get("SNAPSHOT_KEEP_LAST", "24"))
+KEEP_DAILY = int(os.environ.get("SNAPSHOT_KEEP_DAILY", "14"))
+
+RECORD_SECTIONS = ("nodes", "links", "groups")
+INLINE_SECTIONS = ("suppressedAutoPairs", "autoEdgeOverrides")
+FORMAT = 2
+# Average entries per list chunk, and the hard cap
+LIST_FANOUT = 64
+LIST_MAX = 4 * LIST_FANOUT
+
+_LOCK = threading.Lock()
+_KNOWN: Set[str] | None = None
+_LAST_AT: float | None = None
+
+
+def _canonical(obj: Any) -> bytes:
+    return json.dumps(obj, ensure_ascii=False, sort_keys=True, separators=(",", ":")).encode("utf-8")
+
+
+def _chunks_dir() -> str:
+    return os.path.join(SNAPSHOT_DIR, "chunks")
+
+
+def _manifests_dir() -> str:
+    return os.path.join(SNAPSHOT_DIR, "manifests")
+
+
+def _chunk_path(h: str) -> str:
+    return os.path.join(_chunks_dir(), h[:2], h)
+
+
+def _write_atomic(path: str, payload: bytes) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(payload)
+    os.replace(tmp, path)
+
+
+def _known() -> Set[str]:
+    # Caller must hold _LOCK
+    global _KNOWN
+    if _KNOWN is None:
+        _KNOWN = set()
+        root = _chunks_dir()
+        if os.path.isdir(root):
+            for sub in os.listdir(root):
+                d = os.path.join(root, sub)
+                if os.path.isdir(d):
+                    _KNOWN.update(x for x in os.listdir(d) if not x.endswith(".tmp"))
+    return _KNOWN
+
+
+def _put_chunk(payload: bytes) -> tuple[str, int]:
+    # Caller must hold _LOCK; returns (hash, bytes newly written)
+    h = hashlib.sha256(payload).hexdigest()
+    known = _known()
+    if h in known:
+        return h, 0
+    _write_atomic(_chunk_path(h), payload)
+    known.add(h)
+    return h, len(payload)
+
+
+def _read_chunk(h: str) -> Any:
+    with open(_chunk_path(h), "rb") as f:
+        return json.loads(f.read().decode("utf-8"))
+
+
+def _split(hashes: List[str]) -> List[List[str]]:
+    groups: List[List[str]] = []
+    cur: List[str] = []
+    for h in hashes:
+        cur.append(h)
+        if int(h[:8], 16) % LIST_FANOUT == 0 or len(cur) >= LIST_MAX:
+            groups.append(cur)
+            cur = []
+    if cur or not groups:
+        groups.append(cur)
+    return groups
+
+
+def _put_list(hashes: List[str]) -> Tuple[str, int]:
+    # Caller must hold _LOCK; stores an ordered hash list as a tree, returns (root, bytes added)
+    depth = 0
+    added = 0
+    while True:
+        level: List[str] = []
+        for group in _split(hashes):
+            h, n = _put_chunk(_canonical({"d": depth, "h": group}))
+            level.append(h)
+            added += n
+        if len(level) == 1:
+            return level[0], added
+        hashes = level
+        depth += 1
+
+
+def _read_list(root: str) -> List[str]:
+    node = _read_chunk(root)
+    if node["d"] == 0:
+        return list(node["h"])
+    out: List[str] = []
+    for child in node["h"]:
+        out.extend(_read_list(child))
+    return out
+
+
+def _mark_list(root: str, live: Set[str]) -> None:
+    # Add the list chunks under root and the records they point at to live
+    if root in live:
+        return
+    live.add(root)
+    node = _read_chunk(root)
+    if node["d"] == 0:
+        live.update(node["h"])
+    else:
+        for child in node["h"]:
+            _mark_list(child, live)
+
+
+def _section_records(data: Dict[str, Any], section: str) -> List[Any]:
+    value = data.get(section)
+    if section == "autoEdgeOverrides":
+        return [[k, v] for k, v in value.items()] if isinstance(value, dict) else []
+    return list(value or [])
+
+
+def _new_snapshot_id() -> str:
+    return datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+
+
+def _write_manifest(manifest: Dict[str, Any]) -> None:
+    _write_atomic(os.path.join(_manifests_dir(), f"{manifest['id']}.json"), _canonical(manifest))
+
+
+def create_snapshot(data: Dict[str, Any], reason: str = "auto") -> Dict[str, Any]:
+    """Store data as a snapshot and return its summary (without chunk lists)."""
+    global _LAST_AT
+    with _LOCK:
+        manifest: Dict[str, Any] = {"id": _new_snapshot_id(), "createdAt": time.time(), "reason": reason, "format": FORMAT}
+        added = 0
+        records = 0
+        for section in RECORD_SECTIONS + INLINE_SECTIONS:
+            if section in INLINE_SECTIONS and section not in data:
+                continue
+            hashes: List[str] = []
+            for rec in _section_records(data, section):
+                h, n = _put_chunk(_canonical(rec))
+                hashes.append(h)
+                added += n
+            manifest[section], n = _put_list(hashes)
+            added += n
+            if section in RECORD_SECTIONS:
+                records += len(hashes)
+        manifest["records"] = records
+        manifest["bytesAdded"] = added
+        _write_manifest(manifest)
+        _LAST_AT = manifest["createdAt"]
+        if reason in ("auto", "manual"):
+            _prune_locked()
+    return _summary(manifest)
+
+
+def store_blob(raw: bytes, source: str, reason: str) -> str:
+    """Keep raw file bytes (e.g. a corrupt data file) as a snapshot; returns its id."""
+    with _LOCK:
+        h, added = _put_chunk(raw)
+        manifest = {
+            "id": _new_snapshot_id(),
+            "createdAt": time.time(),
+            "reason": reason,
+            "source": source,
+            "raw": h,
+            "records": 0,
+            "bytesAdded": added,
+        }
+        _write_manifest(manifest)
+    return manifest["id"]
+
+
+def maybe_snapshot(data: Dict[str, Any]) -> None:
+    """Take an automatic snapshot if SNAPSHOT_INTERVAL has elapsed since the last one."""
+    global _LAST_AT
+    if SNAPSHOT_INTERVAL <= 0:
+        return
+    with _LOCK:
+        if _LAST_AT is None:
+            latest = [m for m in _read_manifests() if m.get("reason") in ("auto", "manual")]
+            _LAST_AT = latest[-1].get("createdAt", 0.0) if latest else 0.0
+        due = time.time() - float(_LAST_AT or 0.0) >= SNAPSHOT_INTERVAL
+    if due:
+        create_snapshot(data, "auto")
+
+
+def _read_manifests(unreadable: List[str] | None = None) -> List[Dict[str, Any]]:
+    # Manifests that fail to parse are skipped and, if given, listed in unreadable
+    d = _manifests_dir()
+    if not os.path.isdir(d):
+        return []
+    out: List[Dict[str, Any]] = []
+    for name in sorted(os.listdir(d)):
+        if not name.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(d, name), "rb") as f:
+                m = json.loads(f.read().decode("utf-8"))
+            if not isinstance(m, dict) or not isinstance(m.get("id"), str):
+                raise ValueError(name)
+            out.append(m)
+        except Exception:
+            if unreadable is not None:
+                unreadable.append(name)
+    return out
+
+
+def _summary(m: Dict[str, Any]) -> Dict[str, Any]:
+    keys = ("id", "createdAt", "reason", "source", "records", "bytesAdded")
+    return {k: m[k] for k in keys if k in m}
+
+
+def list_snapshots() -> List[Dict[str, Any]]:
+    with _LOCK:
+        return [_summary(m) for m in _read_manifests()]
+
+
+def load_snapshot(snapshot_id: str) -> Dict[str, Any] | None:
+    """Rebuild the data document stored in a snapshot; None if it does not exist."""
+    if not snapshot_id or "/" in snapshot_id or "\\" in snapshot_id or snapshot_id.startswith("."):
+        return None
+    path = os.path.join(_manifests_dir(), f"{snapshot_id}.json")
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as f:
+        manifest = json.loads(f.read().decode("utf-8"))
+    if "raw" in manifest:
+        return _read_chunk(manifest["raw"])
+    data: Dict[str, Any] = {}
+    for section in RECORD_SECTIONS + INLINE_SECTIONS:
+        if section not in manifest:
+            continue
+        recs = [_read_chunk(h) for h in _read_list(manifest[section])]
+        data[section] = {k: v for k, v in recs} if section == "autoEdgeOverrides" else recs
+    return data
+
+
+def _prune_locked() -> None:
+    # Retention: keep the newest KEEP_LAST routine snapshots plus the newest per day
+    # for KEEP_DAILY days; raw backups are never pruned. Then sweep orphan chunks.
+    unreadable: List[str] = []
+    manifests = _read_manifests(unreadable)
+    routine = [m for m in manifests if m.get("reason") in ("auto", "manual")]
+    keep: Set[str] = {m["id"] for m in routine[-KEEP_LAST:]} if KEEP_LAST > 0 else set()
+    days: Dict[str, str] = {}
+    for m in routine:
+        day = datetime.fromtimestamp(float(m.get("createdAt", 0))).strftime("%Y%m%d")
+        days[day] = m["id"]
+    if KEEP_DAILY > 0:
+        keep.update(days[day] for day in sorted(days)[-KEEP_DAILY:])
+    dropped = {m["id"] for m in routine if m["id"] not in keep}
+    if not dropped:
+        return
+    for sid in dropped:
+        try:
+            os.remove(os.path.join(_manifests_dir(), f"{sid}.json"))
+        except OSError:
+            pass
+    if unreadable:
+        # A manifest we cannot parse may still reference chunks; never sweep blind
+        return
+    live: Set[str] = set()
+    try:
+        for m in manifests:
+            if m["id"] in dropped:
+                continue
+            if "raw" in m:
+                live.add(m["raw"])
+            for section in RECORD_SECTIONS + INLINE_SECTIONS:
+                if isinstance(m.get(section), str):
+                    _mark_list(m[section], live)
+    except Exception:
+        return  # an unreadable list chunk leaves the live set incomplete
+    known = _known()
+    for h in list(known - live):
+        try:
+            os.remove(_chunk_path(h))
+        except OSError:
+            pass
+        known.discard(h)
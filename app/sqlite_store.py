@@ -0,0 +1,482 @@
+"""SQLite persistence backend (stdlib sqlite3, WAL mode).
+
+Stores the same document as data.json, split into rows: nodes, fields, links,
+groups (+ members), suppressed pairs and auto edge overrides. Fields are indexed
+on (field_key, field_value) for search and on their normalized match keys (see
+matching.py) for Rule B. Saves diff against the last persisted state and only
+touch changed rows.
+
+Rows are keyed by the record's id; records without a usable one (missing,
+not a string, duplicate) get an ordinal key instead. The record itself is kept
+in `body`, so loading gives back exactly what was saved.
+
+    python -m app.sqlite_store import app/data.json app/data.sqlite
+    python -m app.sqlite_store export app/data.sqlite app/data.json
+"""
+
+from __future__ import annotations
+
+import json
+import sqlite3
+import sys
+import threading
+from typing import Any, Dict, List, Set, Tuple
+
+from .refs import pair_key, split_override_key
+from . import matching
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS nodes (
+    key TEXT PRIMARY KEY,
+    id TEXT,
+    ord INTEGER NOT NULL,
+    has_fields INTEGER NOT NULL,
+    body TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS fields (
+    node_key TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    field_key TEXT,
+    field_type TEXT,
+    field_value TEXT,
+    match_key TEXT,
+    match_value TEXT,
+    body TEXT NOT NULL,
+    PRIMARY KEY (node_key, idx)
+);
+CREATE INDEX IF NOT EXISTS ix_fields_kv ON fields (field_key, field_value);
+CREATE INDEX IF NOT EXISTS ix_fields_type ON fields (field_type, field_value);
+CREATE INDEX IF NOT EXISTS ix_fields_match ON fields (match_key, match_value);
+CREATE TABLE IF NOT EXISTS names (
+    node_key TEXT NOT NULL,
+    idx INTEGER,
+    name TEXT NOT NULL,
+    name_key TEXT
+);
+CREATE INDEX IF NOT EXISTS ix_names_node ON names (node_key);
+CREATE TABLE IF NOT EXISTS links (
+    key TEXT PRIMARY KEY,
+    ord INTEGER NOT NULL,
+    source TEXT,
+    target TEXT,
+    body TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_links_source ON links (source);
+CREATE INDEX IF NOT EXISTS ix_links_target ON links (target);
+CREATE TABLE IF NOT EXISTS groups (
+    key TEXT PRIMARY KEY,
+    ord INTEGER NOT NULL,
+    body TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS group_members (
+    group_key TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    node_id TEXT NOT NULL,
+    PRIMARY KEY (group_key, idx)
+);
+CREATE INDEX IF NOT EXISTS ix_group_members_node ON group_members (node_id);
+CREATE TABLE IF NOT EXISTS suppressed_pairs (
+    a TEXT NOT NULL,
+    b TEXT NOT NULL,
+    PRIMARY KEY (a, b)
+);
+CREATE TABLE IF NOT EXISTS overrides (
+    key TEXT PRIMARY KEY,
+    source TEXT,
+    target TEXT,
+    cpd TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS settings (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+# Sections with their own tables; other top-level keys go to meta
+_TABLED = {"nodes", "links", "groups", "suppressedAutoPairs", "autoEdgeOverrides"}
+# Spacing of sparse `ord` keys, leaving room for inserts between rows
+ORD_STEP = 1024
+
+
+def _dumps(obj: Any) -> str:
+    return json.dumps(obj, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+
+
+def _str(v: Any) -> str | None:
+    # Indexed columns hold strings only; anything else is NULL there and kept in body
+    return v if isinstance(v, str) else None
+
+
+def _field_row(nkey: str, i: int, f: Any) -> Tuple[Any, ...]:
+    d = f if isinstance(f, dict) else {}
+    k = _str(d.get("key")); v = _str(d.get("value"))
+    return (
+        nkey, i, k, _str(d.get("type")), v,
+        matching.match_key(k) if k is not None else None,
+        matching.match_key(v) if v is not None else None,
+        _dumps(f),
+    )
+
+
+def _order_keys(ids: List[str], last: Dict[str, Tuple[int, str]]) -> Dict[str, int]:
+    """Sparse order keys for ids, keeping the stored key of every row that stays in order.
+
+    The longest run of surviving rows whose old keys still increase keeps them; other
+    rows are slotted into the gaps. Deletes and appends therefore touch no other rows.
+    Everything is renumbered only when a gap runs out.
+    """
+    olds = [(i, last[r][0]) for i, r in enumerate(ids) if r in last]
+    # longest strictly increasing subsequence of old keys (patience sorting)
+    tails: List[int] = []
+    prev = [-1] * len(olds)
+    for j, (_, k) in enumerate(olds):
+        lo, hi = 0, len(tails)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if olds[tails[mid]][1] < k:
+                lo = mid + 1
+            else:
+                hi = mid
+        prev[j] = tails[lo - 1] if lo else -1
+        if lo == len(tails):
+            tails.append(j)
+        else:
+            tails[lo] = j
+    keep: Dict[int, int] = {}
+    j = tails[-1] if tails else -1
+    while j >= 0:
+        keep[olds[j][0]] = olds[j][1]
+        j = prev[j]
+
+    out: Dict[str, int] = {}
+    low: int | None = None
+    i = 0
+    while i < len(ids):
+        if i in keep:
+            low = keep[i]
+            out[ids[i]] = low
+            i += 1
+            continue
+        start = i
+        while i < len(ids) and i not in keep:
+            i += 1
+        run = ids[start:i]
+        high = keep.get(i)
+        if high is None:
+            base = low if low is not None else 0
+            for m, r in enumerate(run, 1):
+                out[r] = base + m * ORD_STEP
+            continue
+        base = low if low is not None else high - (len(run) + 1) * ORD_STEP
+        gap = high - base
+        if gap <= len(run):
+            return {r: (m + 1) * ORD_STEP for m, r in enumerate(ids)}
+        for m, r in enumerate(run, 1):
+            out[r] = base + gap * m // (len(run) + 1)
+    return out
+
+
+def _keyed(records: List[Any]) -> List[Tuple[str, Any]]:
+    """(row key, record) for every record: its id if usable, else an ordinal key.
+
+    Ordinal keys start with NUL, so string ids that do are not usable either.
+    """
+    seen: Set[str] = set()
+    out: List[Tuple[str, Any]] = []
+    n = 0
+    for r in records:
+        rid = r.get("id") if isinstance(r, dict) else None
+        if not isinstance(rid, str) or rid in seen or rid.startswith("\0"):
+            n += 1
+            rid = f"\0{n}"
+        seen.add(rid)
+        out.append((rid, r))
+    return out
+
+
+def _name_rows(nkey: str, fields: List[Any]) -> List[Tuple[str, int, str, str]]:
+    # 与 compute_auto_links 的 Rule B 名称收集一致
+    names = matching.node_names([f for f in fields if isinstance(f, dict)])
+    return [(nkey, i, disp, key) for i, (disp, key) in enumerate(names)]
+
+
+class SqliteStore:
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        row = self._conn.execute("SELECT value FROM settings WHERE key = 'match_normalize'").fetchone()
+        if row is None or row[0] != matching.describe():
+            self._rebuild_match_keys()
+        # Fingerprints of what is on disk, to write only changed rows
+        self._nodes: Dict[str, Tuple[int, str]] = {}
+        self._links: Dict[str, Tuple[int, str]] = {}
+        self._groups: Dict[str, Tuple[int, str]] = {}
+        self._pairs: Set[Tuple[str, str]] = set()
+        self._overrides: Dict[str, str] = {}
+        self._meta: Dict[str, str] = {}
+        # Set by the first save; an empty but seeded database is a real, empty document
+        self._seeded = self._conn.execute("SELECT 1 FROM settings WHERE key = 'seeded'").fetchone() is not None
+        # Caller-supplied version of the state on disk (storage._GEN), None if unknown
+        self.generation: int | None = None
+
+    def _rebuild_match_keys(self) -> None:
+        # Stored match keys depend on MATCH_NORMALIZE; recompute when it changes
+        c = self._conn
+        c.execute("BEGIN IMMEDIATE")
+        try:
+            by_node: Dict[str, List[Any]] = {}
+            for nkey, idx, body in c.execute("SELECT node_key, idx, body FROM fields ORDER BY node_key, idx").fetchall():
+                f = json.loads(body)
+                by_node.setdefault(nkey, []).append(f)
+                row = _field_row(nkey, idx, f)
+                c.execute("UPDATE fields SET match_key = ?, match_value = ? WHERE node_key = ? AND idx = ?", (row[5], row[6], nkey, idx))
+            c.execute("DELETE FROM names")
+            for nkey, fields in by_node.items():
+                c.executemany("INSERT INTO names (node_key, idx, name, name_key) VALUES (?, ?, ?, ?)", _name_rows(nkey, fields))
+            c.execute("INSERT OR REPLACE INTO settings (key, value) VALUES ('match_normalize', ?)", (matching.describe(),))
+            c.execute("COMMIT")
+        except Exception:
+            c.execute("ROLLBACK")
+            raise
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def is_seeded(self) -> bool:
+        """Whether a document was ever saved here (even one that is empty now)."""
+        with self._lock:
+            return self._seeded
+
+    # --- load -----------------------------------------------------------
+    def load(self, generation: int | None = None) -> Dict[str, Any]:
+        with self._lock:
+            self.generation = generation
+            c = self._conn
+            fields_by_node: Dict[str, List[Any]] = {}
+            for nkey, body in c.execute("SELECT node_key, body FROM fields ORDER BY node_key, idx"):
+                fields_by_node.setdefault(nkey, []).append(json.loads(body))
+            nodes: List[Any] = []
+            self._nodes = {}
+            for nkey, ord_, has_fields, body in c.execute("SELECT key, ord, has_fields, body FROM nodes ORDER BY ord"):
+                node = json.loads(body)
+                if has_fields:
+                    node["fields"] = fields_by_node.get(nkey, [])
+                nodes.append(node)
+                self._nodes[nkey] = (ord_, _dumps(node))
+            links: List[Any] = []
+            self._links = {}
+            for lkey, ord_, body in c.execute("SELECT key, ord, body FROM links ORDER BY ord"):
+                links.append(json.loads(body))
+                self._links[lkey] = (ord_, body)
+            groups: List[Any] = []
+            self._groups = {}
+            for gkey, ord_, body in c.execute("SELECT key, ord, body FROM groups ORDER BY ord"):
+                groups.append(json.loads(body))
+                self._groups[gkey] = (ord_, body)
+            self._pairs = {(a, b) for a, b in c.execute("SELECT a, b FROM suppressed_pairs ORDER BY a, b")}
+            self._overrides = {k: v for k, v in c.execute("SELECT key, cpd FROM overrides")}
+            self._meta = {k: v for k, v in c.execute("SELECT key, value FROM meta")}
+        data: Dict[str, Any] = {k: json.loads(v) for k, v in self._meta.items()}
+        data["nodes"] = nodes
+        data["links"] = links
+        data["groups"] = groups
+        data["suppressedAutoPairs"] = [{"a": a, "b": b} for a, b in sorted(self._pairs)]
+        data["autoEdgeOverrides"] = {k: json.loads(v) for k, v in self._overrides.items()}
+        return data
+
+    # --- save -----------------------------------------------------------
+    def save(self, data: Dict[str, Any], generation: int | None = None) -> None:
+        """Persist data, writing only rows that differ from the last load/save."""
+        with self._lock:
+            c = self._conn
+            c.execute("BEGIN IMMEDIATE")
+            try:
+                nodes_fp = self._save_nodes(c, data.get("nodes", []) or [])
+                links_fp = self._save_records(c, "links", data.get("links", []) or [], self._links)
+                groups_fp = self._save_records(c, "groups", data.get("groups", []) or [], self._groups)
+                pairs = self._save_pairs(c, data.get("suppressedAutoPairs", []) or [])
+                overrides = self._save_overrides(c, data.get("autoEdgeOverrides", {}) or {})
+                meta = self._save_meta(c, data)
+                if not self._seeded:
+                    c.execute("INSERT OR REPLACE INTO settings (key, value) VALUES ('seeded', '1')")
+                c.execute("COMMIT")
+            except Exception:
+                c.execute("ROLLBACK")
+                raise
+            self._nodes, self._links, self._groups = nodes_fp, links_fp, groups_fp
+            self._pairs, self._overrides, self._meta = pairs, overrides, meta
+            self._seeded = True
+            self.generation = generation
+
+    def _save_nodes(self, c: sqlite3.Connection, nodes: List[Any]) -> Dict[str, Tuple[int, str]]:
+        seen: Dict[str, Tuple[int, str]] = {}
+        rows = _keyed(nodes)
+        keys = _order_keys([nkey for nkey, _ in rows], self._nodes)
+        for nkey, n in rows:
+            ord_ = keys[nkey]
+            fp = _dumps(n)
+            seen[nkey] = (ord_, fp)
+            old = self._nodes.get(nkey)
+            if old == (ord_, fp):
+                continue
+            # A fields list goes to the fields table; any other shape stays in body
+            fields = n.get("fields") if isinstance(n, dict) else None
+            has_fields = isinstance(fields, list)
+            body = _dumps({k: v for k, v in n.items() if k != "fields"} if has_fields else n)
+            nid = _str(n.get("id")) if isinstance(n, dict) else None
+            if old is None:
+                c.execute("INSERT OR REPLACE INTO nodes (key, id, ord, has_fields, body) VALUES (?, ?, ?, ?, ?)", (nkey, nid, ord_, int(has_fields), body))
+            else:
+                c.execute("UPDATE nodes SET id = ?, ord = ?, has_fields = ?, body = ? WHERE key = ?", (nid, ord_, int(has_fields), body, nkey))
+                if old[1] == fp:
+                    continue  # only the order moved
+            c.execute("DELETE FROM fields WHERE node_key = ?", (nkey,))
+            c.execute("DELETE FROM names WHERE node_key = ?", (nkey,))
+            if has_fields:
+                c.executemany(
+                    "INSERT INTO fields (node_key, idx, field_key, field_type, field_value, match_key, match_value, body) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    [_field_row(nkey, i, f) for i, f in enumerate(fields)],
+                )
+                c.executemany("INSERT INTO names (node_key, idx, name, name_key) VALUES (?, ?, ?, ?)", _name_rows(nkey, fields))
+        for nkey in self._nodes.keys() - seen.keys():
+            c.execute("DELETE FROM nodes WHERE key = ?", (nkey,))
+            c.execute("DELETE FROM fields WHERE node_key = ?", (nkey,))
+            c.execute("DELETE FROM names WHERE node_key = ?", (nkey,))
+        return seen
+
+    def _save_records(self, c: sqlite3.Connection, table: str, records: List[Any], last: Dict[str, Tuple[int, str]]) -> Dict[str, Tuple[int, str]]:
+        seen: Dict[str, Tuple[int, str]] = {}
+        rows = _keyed(records)
+        keys = _order_keys([rkey for rkey, _ in rows], last)
+        for rkey, r in rows:
+            ord_ = keys[rkey]
+            body = _dumps(r)
+            seen[rkey] = (ord_, body)
+            if last.get(rkey) == (ord_, body):
+                continue
+            d = r if isinstance(r, dict) else {}
+            if table == "links":
+                c.execute(
+                    "INSERT OR REPLACE INTO links (key, ord, source, target, body) VALUES (?, ?, ?, ?, ?)",
+                    (rkey, ord_, _str(d.get("source")), _str(d.get("target")), body),
+                )
+            else:
+                c.execute("INSERT OR REPLACE INTO groups (key, ord, body) VALUES (?, ?, ?)", (rkey, ord_, body))
+                c.execute("DELETE FROM group_members WHERE group_key = ?", (rkey,))
+                members = d.get("members")
+                members = [m for m in members if isinstance(m, str)] if isinstance(members, list) else []
+                c.executemany(
+                    "INSERT INTO group_members (group_key, idx, node_id) VALUES (?, ?, ?)",
+                    [(rkey, i, m) for i, m in enumerate(members)],
+                )
+        for rkey in last.keys() - seen.keys():
+            c.execute(f"DELETE FROM {table} WHERE key = ?", (rkey,))
+            if table == "groups":
+                c.execute("DELETE FROM group_members WHERE group_key = ?", (rkey,))
+        return seen
+
+    def _save_pairs(self, c: sqlite3.Connection, pairs: List[Dict[str, Any]]) -> Set[Tuple[str, str]]:
+        now = {k for k in (pair_key(p.get("a"), p.get("b")) for p in pairs if isinstance(p, dict)) if k is not None}
+        c.executemany("INSERT OR IGNORE INTO suppressed_pairs (a, b) VALUES (?, ?)", list(now - self._pairs))
+        c.executemany("DELETE FROM suppressed_pairs WHERE a = ? AND b = ?", list(self._pairs - now))
+        return now
+
+    def _save_overrides(self, c: sqlite3.Connection, overrides: Dict[str, Any]) -> Dict[str, str]:
+        now = {k: _dumps(v) for k, v in overrides.items() if isinstance(k, str)}
+        for k, v in now.items():
+            if self._overrides.get(k) != v:
+                ends = split_override_key(k) or (None, None)
+                c.execute("INSERT OR REPLACE INTO overrides (key, source, target, cpd) VALUES (?, ?, ?, ?)", (k, ends[0], ends[1], v))
+        c.executemany("DELETE FROM overrides WHERE key = ?", [(k,) for k in self._overrides.keys() - now.keys()])
+        return now
+
+    def _save_meta(self, c: sqlite3.Connection, data: Dict[str, Any]) -> Dict[str, str]:
+        now = {k: _dumps(v) for k, v in data.items() if k not in _TABLED}
+        for k, v in now.items():
+            if self._meta.get(k) != v:
+                c.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (k, v))
+        c.executemany("DELETE FROM meta WHERE key = ?", [(k,) for k in self._meta.keys() - now.keys()])
+        return now
+
+    # --- indexed queries ------------------------------------------------
+    def find_nodes(self, key: str | None = None, value: str | None = None, generation: int | None = None) -> List[str] | None:
+        """Ids of nodes having a field matching key and/or (string) value.
+
+        With a generation, returns None unless the database holds that state.
+        """
+        conds: List[str] = ["f.node_key = n.key"]
+        args: List[Any] = []
+        if key is not None:
+            conds.append("f.field_key = ?")
+            args.append(key)
+        if value is not None:
+            conds.append("f.field_value = ?")
+            args.append(value)
+        sql = f"SELECT n.id FROM nodes n WHERE n.id IS NOT NULL AND EXISTS (SELECT 1 FROM fields f WHERE {' AND '.join(conds)}) ORDER BY n.ord"
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return None
+            return [r[0] for r in self._conn.execute(sql, args)]
+
+    def rule_b_pairs(self, filter_field_keys: List[str] | None = None, generation: int | None = None) -> List[Tuple[str, str, str, str]] | None:
+        """Rule B matches as (tagged node, target node, tag, name) via the normalized (key, value) index.
+
+        Rows come in the order compute_auto_links visits them, so keeping the first
+        row per node pair gives the same links and labels. With a generation,
+        returns None unless the database holds that state.
+        """
+        sql = """
+            SELECT tn.id, fn.id, t.field_value, nm.name
+            FROM fields t
+            JOIN nodes tn ON tn.key = t.node_key
+            JOIN names nm ON nm.node_key = t.node_key
+            JOIN fields f ON f.match_key = t.match_value AND f.match_value = nm.name_key
+            JOIN nodes fn ON fn.key = f.node_key
+            WHERE t.field_type = 'tag' AND t.field_value != '' AND tn.id != '' AND fn.id != '' AND fn.id != tn.id
+        """
+        args: List[Any] = []
+        keys = sorted({matching.match_key(k) for k in filter_field_keys or () if isinstance(k, str)})
+        if keys:
+            sql += f" AND t.match_value IN ({', '.join('?' * len(keys))})"
+            args.extend(keys)
+        sql += " ORDER BY tn.ord, t.idx, nm.idx, fn.ord, f.idx"
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return None
+            return [tuple(r) for r in self._conn.execute(sql, args)]  # type: ignore[misc]
+
+
+def _cli(argv: List[str]) -> int:
+    from .storage import dumps_bytes, loads_bytes
+
+    if len(argv) != 3 or argv[0] not in ("import", "export"):
+        print("usage: python -m app.sqlite_store import <data.json> <db.sqlite>\n"
+              "       python -m app.sqlite_store export <db.sqlite> <data.json>")
+        return 2
+    if argv[0] == "import":
+        with open(argv[1], "rb") as f:
+            data = loads_bytes(f.read()) or {}
+        store = SqliteStore(argv[2])
+        store.load()
+        store.save(data)
+        store.close()
+    else:
+        store = SqliteStore(argv[1])
+        data = store.load()
+        store.close()
+        with open(argv[2], "wb") as f:
+            f.write(dumps_bytes(data))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(_cli(sys.argv[1:]))
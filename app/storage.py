@@ -5,12 +5,17 @@ import atexit
 import threading
 import time
 import uuid
-from typing import Any, Dict
+from typing import Any, Callable, Dict, List, Tuple
 from datetime import datetime
 from copy import deepcopy
 
 import json as _stdlib_json
 
+from .refs import RefChanges, RefIndex, compact_refs
+from .utils import auto_links_from_matches
+from .compact import PackedDoc, pack, unpack
+from . import snapshots
+
 try:  # optional acceleration
     import orjson as _orjson  # type: ignore
 except Exception:  # pragma: no cover
@@ -19,13 +24,32 @@ except Exception:  # pragma: no cover
 
 DATA_PATH = os.path.join(os.path.dirname(__file__), "data.json")
 TEMPLATES_PATH = os.path.join(os.path.dirname(__file__), "templates.json")
+# Persistence backend for the data document: "json" (data.json) or "sqlite"
+STORE_BACKEND = os.environ.get("STORE_BACKEND", "json").strip().lower()
+SQLITE_PATH = os.environ.get("STORE_SQLITE_PATH") or os.path.join(os.path.dirname(__file__), "data.sqlite")
+_SQLITE: Any = None
 
 # In-memory cache and debounced flush
-_CACHE: Dict[str, Any] | None = None
+# The cache holds a PackedDoc (see compact.py); it is replaced, never mutated
+_CACHE: PackedDoc | None = None
 _CACHE_LOCK = threading.Lock()
 _DIRTY = False
 _FLUSH_TIMER: threading.Timer | None = None
 _FLUSH_DELAY = float(os.environ.get("STORE_FLUSH_DELAY_SEC", "0.8"))  # seconds
+# One flush at a time, so an older state can never be written after a newer one
+_FLUSH_LOCK = threading.Lock()
+# Bumped whenever the cache is replaced; the sqlite store records the one it holds
+_GEN = 0
+# Reverse reference index for the current cache. Mutation paths update it in place
+# and hand it back to write_all; any other write drops it and it is rebuilt lazily.
+_REFS: RefIndex | None = None
+# Called as fn(old, new, gen) under the cache lock whenever the cache is replaced,
+# so derived caches are invalidated before anyone can read the new state
+_WRITE_LISTENERS: List[Callable[[PackedDoc | None, PackedDoc, int], None]] = []
+# Templates cache, validated against the file mtime; flushed by the same timer
+_TEMPLATES: Dict[str, Any] | None = None
+_TEMPLATES_MTIME: float | None = None
+_TEMPLATES_DIRTY = False
 
 
 def dumps_bytes(obj: Any) -> bytes:
@@ -103,12 +127,9 @@ def _load(path: str, default: Any) -> Any:
                     candidate = text[start:end+1]
                     try:
                         data_obj = _stdlib_json.loads(candidate)
-                        # Backup corrupt file, then save repaired JSON
+                        # Backup corrupt file into the snapshot store, then save repaired JSON
                         try:
-                            ts = datetime.now().strftime("%Y%m%d-%H%M%S")
-                            bak = f"{path}.corrupt-{ts}.bak"
-                            with open(bak, "wb") as bf:
-                                bf.write(raw)
+                            _backup_raw(path, raw, "corrupt")
                         finally:
                             _save(path, data_obj)
                         return data_obj
@@ -116,10 +137,7 @@ def _load(path: str, default: Any) -> Any:
                         pass
             # If salvage fails, backup and reset to default
             try:
-                ts = datetime.now().strftime("%Y%m%d-%H%M%S")
-                bak = f"{path}.corrupt-{ts}.bak"
-                with open(bak, "wb") as bf:
-                    bf.write(raw)
+                _backup_raw(path, raw, "corrupt")
             finally:
                 _save(path, default)
             return default
@@ -153,33 +171,103 @@ def _save(path: str, data: Any) -> None:
             raise last_err
     except PermissionError as e:
         # Backup original file for diagnosis
+        bak = ""
         try:
-            ts = datetime.now().strftime("%Y%m%d-%H%M%S")
-            bak = f"{path}.permerr-{ts}.bak"
             if os.path.exists(path):
-                with open(path, "rb") as orig, open(bak, "wb") as bf:
-                    bf.write(orig.read())
+                with open(path, "rb") as orig:
+                    bak = _backup_raw(path, orig.read(), "permerr")
         except Exception:
             pass
         raise PermissionError(f"拒绝访问: {path}。请确认无其他程序占用或只读属性。已备份到 {bak}") from e
 
 
+def _backup_raw(path: str, raw: bytes, reason: str) -> str:
+    # Content-addressed, so repeated failures on the same bytes cost nothing extra.
+    # Fall back to a plain .bak copy if the snapshot store itself is unusable.
+    try:
+        sid = snapshots.store_blob(raw, os.path.basename(path), reason)
+        return f"快照 {sid}"
+    except Exception:
+        ts = datetime.now().strftime("%Y%m%d-%H%M%S")
+        bak = f"{path}.{reason}-{ts}.bak"
+        with open(bak, "wb") as bf:
+            bf.write(raw)
+        return bak
+
+
+def _mtime(path: str) -> float | None:
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
 def _flush_to_disk_safe() -> None:
-    global _DIRTY, _FLUSH_TIMER
+    with _FLUSH_LOCK:
+        _flush_locked()
+
+
+def _flush_locked() -> None:
+    global _DIRTY, _FLUSH_TIMER, _TEMPLATES_DIRTY, _TEMPLATES_MTIME
     # Take a snapshot under lock
     with _CACHE_LOCK:
-        local = deepcopy(_CACHE) if _CACHE is not None else default_data()
+        doc = _CACHE
+        gen = _GEN
         _FLUSH_TIMER = None
         dirty = _DIRTY
         _DIRTY = False
-    if not dirty:
-        return
-    try:
-        _save(DATA_PATH, local)
-    except Exception:
-        # If saving fails, mark dirty again to retry on next write
-        with _CACHE_LOCK:
-            _DIRTY = True
+        tpl_local = deepcopy(_TEMPLATES) if _TEMPLATES_DIRTY else None
+        _TEMPLATES_DIRTY = False
+    if dirty:
+        try:
+            local = unpack(doc) if doc is not None else default_data()
+            _backend_save(local, gen)
+        except Exception:
+            # If saving fails, mark dirty again to retry on next write
+            with _CACHE_LOCK:
+                _DIRTY = True
+        else:
+            try:
+                snapshots.maybe_snapshot(local)
+            except Exception:
+                pass
+    if tpl_local is not None:
+        try:
+            _save(TEMPLATES_PATH, tpl_local)
+            with _CACHE_LOCK:
+                if not _TEMPLATES_DIRTY:
+                    _TEMPLATES_MTIME = _mtime(TEMPLATES_PATH)
+        except Exception:
+            with _CACHE_LOCK:
+                _TEMPLATES_DIRTY = True
+
+
+def _sqlite_store() -> Any:
+    global _SQLITE
+    if _SQLITE is None:
+        from .sqlite_store import SqliteStore
+
+        _SQLITE = SqliteStore(SQLITE_PATH)
+    return _SQLITE
+
+
+def _backend_load() -> Dict[str, Any]:
+    if STORE_BACKEND == "sqlite":
+        store = _sqlite_store()
+        if not store.is_seeded() and os.path.exists(DATA_PATH):
+            # First start on sqlite: seed from the existing data.json, once
+            data = _load(DATA_PATH, default_data())
+            store.save(data, _GEN)
+            return data
+        return store.load(_GEN)
+    return _load(DATA_PATH, default_data())
+
+
+def _backend_save(data: Dict[str, Any], gen: int) -> None:
+    if STORE_BACKEND == "sqlite":
+        _sqlite_store().save(data, gen)
+    else:
+        _save(DATA_PATH, data)
 
 
 def _schedule_flush() -> None:
@@ -214,31 +302,144 @@ def default_templates() -> Dict[str, Any]:
     }
 
 
+def _ensure_cache() -> PackedDoc:
+    # Caller must hold _CACHE_LOCK
+    global _CACHE, _DIRTY, _GEN
+    if _CACHE is None:
+        data = _backend_load()
+        # One-shot compaction of dangling references left by older versions
+        removed = compact_refs(data)
+        _CACHE = pack(data)
+        if any(removed.values()):
+            _GEN += 1
+            _DIRTY = True
+            _schedule_flush()
+    return _CACHE
+
+
 def read_all() -> Dict[str, Any]:
-    global _CACHE
+    return read_versioned()[0]
+
+
+def read_versioned() -> Tuple[Dict[str, Any], PackedDoc, int]:
+    """read_all plus the packed state it was unpacked from and its generation.
+
+    data["nodes"][i] comes from doc.nodes[i], so per-record data such as stored
+    match keys lines up with it; the generation is for indexed_auto_links.
+    """
+    doc, gen = versioned_state()
+    # Unpacking builds fresh dicts, so callers may mutate the result freely
+    return unpack(doc), doc, gen
+
+
+def versioned_state() -> Tuple[PackedDoc, int]:
+    """The packed cache (read-only) and its generation, without unpacking."""
     with _CACHE_LOCK:
-        if _CACHE is None:
-            _CACHE = _load(DATA_PATH, default_data())
-        local: Dict[str, Any] = _CACHE  # type: ignore[assignment]
-    # Return a deepcopy to prevent accidental external mutation of cache structure
-    return deepcopy(local)
+        return _ensure_cache(), _GEN
+
+
+def write_all(data: Dict[str, Any], refs: RefChanges | None = None) -> None:
+    """Replace the cached data; refs are the index updates recorded for data, if any."""
+    write_state(snapshot_state(data), refs)
+
 
+def snapshot_state(data: Dict[str, Any]) -> PackedDoc:
+    """Pack data for keeping around (e.g. undo history), sharing unchanged nodes with the cache."""
+    return pack(data, _CACHE)
 
-def write_all(data: Dict[str, Any]) -> None:
-    global _CACHE, _DIRTY
+
+def current_state() -> PackedDoc:
+    with _CACHE_LOCK:
+        return _ensure_cache()
+
+
+def write_state(doc: PackedDoc, refs: RefChanges | None = None) -> None:
+    global _CACHE, _DIRTY, _REFS, _GEN
     with _CACHE_LOCK:
-        _CACHE = deepcopy(data)
+        # The index changes only here, with the cache: by the write's recorded
+        # updates if it was based on the current state, else it is rebuilt on next use
+        if refs is not None and _REFS is not None and refs.gen == _GEN:
+            refs.apply(_REFS)
+        else:
+            _REFS = None
+        old = _CACHE
+        _CACHE = doc
+        _GEN += 1
+        for fn in _WRITE_LISTENERS:
+            fn(old, doc, _GEN)
         _DIRTY = True
     _schedule_flush()
 
 
+def add_write_listener(fn: Callable[[PackedDoc | None, PackedDoc, int], None]) -> None:
+    _WRITE_LISTENERS.append(fn)
+
+
+def read_with_refs() -> Tuple[Dict[str, Any], RefIndex, RefChanges]:
+    """read_all() plus the reverse reference index of the same state (read-only
+    for callers), and a RefChanges to record the index updates of writing it
+    back (pass that to write_all)."""
+    global _REFS
+    with _CACHE_LOCK:
+        doc = _ensure_cache()
+        if _REFS is None:
+            _REFS = RefIndex.build(doc.rest)
+        refs, gen = _REFS, _GEN
+    return unpack(doc), refs, RefChanges(gen)
+
+
+def find_nodes(key: str | None = None, value: str | None = None) -> List[str]:
+    """Ids of nodes with a field matching key and/or value (indexed query on sqlite)."""
+    with _CACHE_LOCK:
+        recs = _ensure_cache().nodes
+        gen = _GEN
+    if STORE_BACKEND == "sqlite":
+        # The database answers only if it holds this exact state; while a write
+        # is still pending, scan the cache instead of flushing from a request
+        ids = _sqlite_store().find_nodes(key, value, gen)
+        if ids is not None:
+            return ids
+    out: List[str] = []
+    for rec in recs:
+        if not isinstance(rec.fields, tuple):
+            continue
+        for f in rec.fields:
+            k, v = (f[0], f[2]) if isinstance(f, tuple) else (f.get("key"), f.get("value"))
+            if (key is None or k == key) and (value is None or v == value):
+                out.append(rec.id)
+                break
+    return out
+
+
+def indexed_auto_links(gen: int, filter_field_keys: List[str] | None = None) -> List[Dict[str, Any]] | None:
+    """Rule B auto links as an indexed sqlite query, or None to fall back to compute_auto_links.
+
+    Only answers when the database holds generation gen, i.e. the same state the
+    caller read; suppressed pairs and overrides are left to the caller.
+    """
+    if STORE_BACKEND != "sqlite":
+        return None
+    rows = _sqlite_store().rule_b_pairs(filter_field_keys, gen)
+    return auto_links_from_matches(rows) if rows is not None else None
+
+
 def read_templates() -> Dict[str, Any]:
-    return _load(TEMPLATES_PATH, default_templates())
+    global _TEMPLATES, _TEMPLATES_MTIME
+    with _CACHE_LOCK:
+        # Pending in-memory edits win; otherwise reload if the file changed on disk
+        if _TEMPLATES is None or (not _TEMPLATES_DIRTY and _mtime(TEMPLATES_PATH) != _TEMPLATES_MTIME):
+            _TEMPLATES = _load(TEMPLATES_PATH, default_templates())
+            _TEMPLATES_MTIME = _mtime(TEMPLATES_PATH)
+        local: Dict[str, Any] = _TEMPLATES
+    return deepcopy(local)
 
 
 def write_templates(data: Dict[str, Any]) -> None:
-    # Templates are less frequently modified; write-through is acceptable
-    _save(TEMPLATES_PATH, data)
+    global _TEMPLATES, _TEMPLATES_DIRTY
+    with _CACHE_LOCK:
+        _TEMPLATES = deepcopy(data)
+        _TEMPLATES_DIRTY = True
+    _schedule_flush()
 
 
 def new_id() -> str:
@@ -1,6 +1,9 @@
 from __future__ import annotations
 
-from typing import Any, Dict, List, Tuple
+import math
+from typing import Any, Dict, Iterable, List, Sequence, Tuple
+
+from .matching import NodeKeys, match_key
 
 
 def stable_color_for_tag(tag: str) -> str:
@@ -38,21 +41,29 @@ def derive_node_style(node: Dict[str, Any]) -> Dict[str, Any]:
     return {"colors": colors, "size": size}
 
 
-def compute_auto_links(nodes: List[Dict[str, Any]], filter_field_keys: List[str] | None = None) -> List[Dict[str, Any]]:
+def compute_auto_links(nodes: List[Dict[str, Any]], filter_field_keys: List[str] | None = None, keys: Sequence[NodeKeys] | None = None) -> List[Dict[str, Any]]:
+    # Matching runs on normalized keys (see matching.py). keys[i] holds the match keys
+    # of nodes[i]; callers reading the packed cache pass views over its records
+    # (PackedDoc.match_keys), so nothing is normalized or split per request.
+    if keys is None:
+        keys = [NodeKeys(n.get("fields")) for n in nodes]
+    return rule_b_links([n.get("id") for n in nodes], keys, filter_field_keys)
+
+
+def rule_b_links(ids: Sequence[Any], keys: Sequence[NodeKeys], filter_field_keys: List[str] | None = None) -> List[Dict[str, Any]]:
+    """compute_auto_links on node ids and their match keys alone (keys[i] belongs to ids[i])."""
+    filters = {match_key(k) for k in filter_field_keys if isinstance(k, str)} if filter_field_keys else None
     # explicit fields index: (key,value) -> node ids
     index: Dict[Tuple[str, str], List[str]] = {}
-    for n in nodes:
-        nid = n.get("id")
+    # NodeKeys lists are built per node and dropped right away; keeping them for
+    # all nodes costs more in GC passes than building them
+    for nid, nk in zip(ids, keys):
         if not isinstance(nid, str) or not nid:
             continue
-        for f in n.get("fields", []):
-            k = f.get("key")
-            v = f.get("value")
-            if not isinstance(k, str) or not isinstance(v, str):
+        for pair in nk.pairs():
+            if filters and pair[0] not in filters:
                 continue
-            if filter_field_keys and k not in filter_field_keys:
-                continue
-            index.setdefault((k, v), []).append(nid)
+            index.setdefault(pair, []).append(nid)
 
     auto_links: List[Dict[str, Any]] = []
     seen: set[tuple[str, str]] = set()
@@ -60,38 +71,18 @@ def compute_auto_links(nodes: List[Dict[str, Any]], filter_field_keys: List[str]
     # Rule B: semantic linking — for each node with 标签(tag)=T and 名称(text)=N,
     # link to nodes that explicitly have field key=T and value=N.
     # Enhancements: 支持多个“名称”字段与别名/名称列表一次性 1->N 匹配。
-    for n in nodes:
-        nid = n.get("id")
+    for nid, nk in zip(ids, keys):
         if not isinstance(nid, str) or not nid:
             continue
-        fields = n.get("fields", []) or []
-        # 收集多名称：所有 key=='名称' 的文本 + 额外列表字段（名称列表/别名/aliases，按常见分隔符切分）
-        name_values: List[str] = []
-        for f in fields:
-            if f.get("key") == "名称" and f.get("type") == "text" and isinstance(f.get("value"), str):
-                v = f.get("value").strip()
-                if v:
-                    name_values.append(v)
-        extra_keys = {"名称列表", "别名", "aliases", "Aliases"}
-        for f in fields:
-            if f.get("key") in extra_keys and f.get("type") == "text" and isinstance(f.get("value"), str):
-                for p in _split_multi_values(f.get("value")):
-                    if p:
-                        name_values.append(p)
-        # 去重保持顺序
-        seen_names: set[str] = set()
-        name_values = [x for x in name_values if (x not in seen_names and (seen_names.add(x) or True))]
+        # 多名称：所有 key=='名称' 的文本 + 额外列表字段（名称列表/别名/aliases），按匹配键去重
+        name_values, tags = nk.names_tags()
         if not name_values:
             continue
-        # tags list
-        tags = [f.get("value") for f in fields if f.get("type") == "tag" and isinstance(f.get("value"), str)]
-        for tag in tags:
-            if not isinstance(tag, str) or not tag:
-                continue
-            if filter_field_keys and tag not in filter_field_keys:
+        for tag, tag_key in tags:
+            if filters and tag_key not in filters:
                 continue
-            for name_val in name_values:
-                target_ids = index.get((tag, name_val), [])
+            for name_val, name_key in name_values:
+                target_ids = index.get((tag_key, name_key), [])
                 for tid in target_ids:
                     if tid == nid:
                         continue
@@ -99,27 +90,65 @@ def compute_auto_links(nodes: List[Dict[str, Any]], filter_field_keys: List[str]
                     if key in seen:
                         continue
                     seen.add(key)
-                    # Direction: point to the node that has the tag (nid)
-                    auto_links.append({
-                        "id": f"auto-{tid}-{nid}",
-                        "source": tid,
-                        "target": nid,
-                        "type": "auto",
-                        "rule": "B",
-                        "label": f"{tag}:{name_val}",
-                    })
+                    auto_links.append(rule_b_link(nid, tid, tag, name_val))
 
 
     return auto_links
 
 
-def _split_multi_values(raw: str) -> List[str]:
-    # 支持以英文/中文逗号、分号、竖线、换行、制表等分隔
-    seps = [",", "，", ";", "|", "\n", "\r", "\t"]
-    parts = [raw]
-    for s in seps:
-        next_parts: List[str] = []
-        for p in parts:
-            next_parts.extend(p.split(s))
-        parts = next_parts
-    return [p.strip() for p in parts if p.strip()]
+def rule_b_link(tagged_id: str, target_id: str, tag: str, name: str) -> Dict[str, Any]:
+    # Direction: point to the node that has the tag
+    return {
+        "id": f"auto-{target_id}-{tagged_id}",
+        "source": target_id,
+        "target": tagged_id,
+        "type": "auto",
+        "rule": "B",
+        "label": f"{tag}:{name}",
+    }
+
+
+def auto_links_from_matches(matches: Iterable[Tuple[str, str, str, str]]) -> List[Dict[str, Any]]:
+    """Rule B links from ordered (tagged id, target id, tag, name) rows, first row per pair wins."""
+    auto_links: List[Dict[str, Any]] = []
+    seen: set[tuple[str, str]] = set()
+    for nid, tid, tag, name in matches:
+        key = (nid, tid) if nid <= tid else (tid, nid)
+        if key in seen:
+            continue
+        seen.add(key)
+        auto_links.append(rule_b_link(nid, tid, tag, name))
+    return auto_links
+
+
+def grid_positions(center: Dict[str, Any] | None, count: int, spacing: float = 120.0, columns: int | None = None) -> List[Dict[str, float]]:
+    # 以 center 为中心排成近似正方形的网格
+    try:
+        cx = float((center or {}).get("x", 0))
+        cy = float((center or {}).get("y", 0))
+    except Exception:
+        cx, cy = 0.0, 0.0
+    if count <= 0:
+        return []
+    cols = columns if columns and columns > 0 else math.ceil(math.sqrt(count))
+    rows = math.ceil(count / cols)
+    x0 = cx - (cols - 1) * spacing / 2
+    y0 = cy - (rows - 1) * spacing / 2
+    return [{"x": x0 + (i % cols) * spacing, "y": y0 + (i // cols) * spacing} for i in range(count)]
+
+
+def apply_field_values(fields: List[Dict[str, Any]], values: Dict[str, Any]) -> List[Dict[str, Any]]:
+    # 按 key 覆盖模板字段的值；模板中没有的 key 以 text 字段追加
+    out = [dict(f) for f in fields if isinstance(f, dict)]
+    for k, v in values.items():
+        if not isinstance(k, str):
+            continue
+        hit = False
+        for f in out:
+            if f.get("key") == k:
+                f["value"] = v
+                hit = True
+                break
+        if not hit:
+            out.append({"key": k, "type": "text", "value": v})
+    return out
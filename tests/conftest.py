@@ -0,0 +1,108 @@
+from __future__ import annotations
+
+import random
+
+import pytest
+
+from app import snapshots, storage
+from app.main import create_app
+from app.utils import compute_auto_links
+
+# Shared by the randomized tests: tags and names chosen to collide under match
+# normalization (case, width, trailing space), plus an empty tag.
+TAGS = ["NPC", "地点", "npc ", "Ｎｐｃ", ""]
+NAMES = ["林清秋", "邮局", "Alice", "alice ", "Bob"]
+
+# Node shapes the stores must round-trip exactly, odd types included
+ODD_NODES = [
+    {"id": "n1", "fields": [{"key": "名称", "type": "text", "value": "林清秋"}], "position": {"x": 1, "y": 2.5}},
+    {"id": "n2", "fields": [{"key": "k", "type": 1, "value": "v"}]},
+    {"id": "n3", "fields": [{"key": "k", "type": 9, "value": "v"}]},
+    {"id": "n4", "fields": [{"key": "k", "type": None, "value": "v"}, {"key": "k", "type": True, "value": "v"}]},
+    {"id": "n5", "fields": [{"key": 3, "type": "text", "value": "v"}]},
+    {"id": "n6", "fields": [{"key": "k", "type": "text", "value": ["a", "b"]}, {"key": "k", "type": "text", "value": {"x": 1}}]},
+    {"id": "n7", "fields": [{"key": "k", "type": "text"}, {"key": "k", "type": "text", "value": "v", "note": "extra"}, "loose", None]},
+    {"id": "n8", "fields": [{"key": "k", "type": "custom", "value": "v"}, {"key": "k", "type": "number", "value": 1}]},
+    {"id": "n9", "fields": [{"key": "a", "type": "number", "value": 1.0}, {"key": "b", "type": "number", "value": True}]},
+    {"id": "n10", "fields": "not a list", "position": [1, 2], "color": "red"},
+    {"id": "n11", "position": {"x": 1, "y": 2, "z": 3}},
+    {"id": "n12", "position": {"x": True, "y": 0}},
+    {"fields": []},
+    {"id": 12, "fields": []},
+]
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(storage, "DATA_PATH", str(tmp_path / "data.json"))
+    monkeypatch.setattr(storage, "TEMPLATES_PATH", str(tmp_path / "templates.json"))
+    monkeypatch.setattr(storage, "STORE_BACKEND", "json")
+    monkeypatch.setattr(storage, "_CACHE", None)
+    monkeypatch.setattr(storage, "_REFS", None)
+    monkeypatch.setattr(storage, "_TEMPLATES", None)
+    monkeypatch.setattr(storage, "_TEMPLATES_MTIME", None)
+    monkeypatch.setattr(snapshots, "SNAPSHOT_DIR", str(tmp_path / "snapshots"))
+    yield create_app().test_client()
+    storage._flush_to_disk_safe()
+
+
+@pytest.fixture
+def sqlite_client(client, tmp_path, monkeypatch):
+    monkeypatch.setattr(storage, "STORE_BACKEND", "sqlite")
+    monkeypatch.setattr(storage, "SQLITE_PATH", str(tmp_path / "data.sqlite"))
+    monkeypatch.setattr(storage, "_SQLITE", None)
+    return client
+
+
+def random_fields(rng: random.Random, max_fields: int = 4):
+    fields = []
+    for _ in range(rng.randint(0, max_fields)):
+        r = rng.random()
+        if r < 0.3:
+            fields.append({"key": "名称", "type": "text", "value": rng.choice(NAMES)})
+        elif r < 0.5:
+            fields.append({"key": "标签", "type": "tag", "value": rng.choice(TAGS)})
+        elif r < 0.6:
+            fields.append({"key": rng.choice(["别名", "Aliases"]), "type": "text", "value": "，".join(rng.sample(NAMES, 2))})
+        elif r < 0.65:
+            fields.append({"key": "名称", "type": "number", "value": 3})
+        else:
+            fields.append({"key": rng.choice(TAGS), "type": "text", "value": rng.choice(NAMES)})
+    return fields
+
+
+def random_node(rng: random.Random, nid: str):
+    return {"id": nid, "fields": random_fields(rng), "position": {"x": rng.randrange(100), "y": 0}}
+
+
+def mutate(data, rng: random.Random, counter):
+    """One random edit of data: nodes, fields, positions, links, suppressed pairs or order."""
+    nodes = data["nodes"]
+    ids = [n["id"] for n in nodes]
+    op = rng.random()
+    counter[0] += 1
+    if op < 0.2 or len(ids) < 2:
+        nodes.append(random_node(rng, f"n{counter[0]}"))
+    elif op < 0.3:
+        gone = rng.choice(ids)
+        data["nodes"] = [n for n in nodes if n["id"] != gone]
+        data["links"] = [l for l in data["links"] if gone not in (l["source"], l["target"])]
+    elif op < 0.5:
+        rng.choice(nodes)["fields"] = random_fields(rng)
+    elif op < 0.6:
+        rng.choice(nodes)["position"] = {"x": rng.random(), "y": 0}
+    elif op < 0.7:
+        data["links"].append({"id": f"l{counter[0]}", "source": rng.choice(ids), "target": rng.choice(ids), "label": rng.choice(["", "认识"])})
+    elif op < 0.75 and data["links"]:
+        rng.choice(data["links"])["label"] = rng.choice(["", "敌对"])
+    elif op < 0.8 and data["links"]:
+        data["links"].pop(rng.randrange(len(data["links"])))
+    elif op < 0.9:
+        # mostly pairs that actually have an auto link
+        auto = [(e["source"], e["target"]) for e in compute_auto_links(nodes)]
+        a, b = rng.choice(auto) if auto else rng.sample(ids, 2)
+        data["suppressedAutoPairs"].append({"a": a, "b": b})
+    elif data["suppressedAutoPairs"]:
+        data["suppressedAutoPairs"].pop(rng.randrange(len(data["suppressedAutoPairs"])))
+    else:
+        rng.shuffle(data["nodes"])
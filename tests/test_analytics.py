@@ -0,0 +1,60 @@
+from __future__ import annotations
+
+import random
+
+import pytest
+
+from app.analytics import GraphIndex
+from app.compact import pack, unpack
+from app.utils import compute_auto_links
+from conftest import mutate
+
+def _visible_auto_pairs(data):
+    suppressed = {tuple(sorted((p["a"], p["b"]))) for p in data["suppressedAutoPairs"]}
+    pairs = {tuple(sorted((e["source"], e["target"]))) for e in compute_auto_links(data["nodes"])}
+    return pairs - suppressed
+
+
+def _assert_same(inc: GraphIndex, full: GraphIndex, data) -> None:
+    assert inc.weight == full.weight
+    assert {k: v for k, v in inc.degree.items() if v} == {k: v for k, v in full.degree.items() if v}
+    assert {k: v for k, v in inc.adj.items() if v} == {k: v for k, v in full.adj.items() if v}
+    assert sorted(map(sorted, inc.components())) == sorted(map(sorted, full.components()))
+    assert sorted(inc.isolated()) == sorted(full.isolated())
+    # auto edges agree with the request-time Rule B computation
+    assert {p for p, n in inc.auto.items() if n > 0} - inc.suppressed == _visible_auto_pairs(data)
+    ids = [n["id"] for n in data["nodes"]]
+    for src in ids[:3]:
+        for dst in ids[-3:]:
+            a, b = inc.shortest_path(src, dst), full.shortest_path(src, dst)
+            assert (a is None) == (b is None)
+            if a is not None:
+                assert len(a) == len(b)
+                assert all(y in inc.adj[x] for x, y in zip(a, a[1:]))
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_incremental_sync_matches_rebuild(seed):
+    rng = random.Random(seed)
+    data = {"nodes": [], "links": [], "suppressedAutoPairs": [], "autoEdgeOverrides": {}}
+    counter = [0]
+    inc = GraphIndex()
+    doc = None
+    for _ in range(60):
+        mutate(data, rng, counter)
+        # mirror storage.write_all: unchanged nodes keep their NodeRec
+        doc = pack(data, doc)
+        assert unpack(doc) == data
+        inc.sync(doc)
+        full = GraphIndex()
+        full.sync(doc)
+        _assert_same(inc, full, data)
+
+
+def test_sync_is_noop_for_same_doc():
+    doc = pack({"nodes": [{"id": "a", "fields": []}], "links": []})
+    idx = GraphIndex()
+    idx.sync(doc)
+    idx.sync(doc)
+    assert idx.components() == [["a"]]
+    assert idx.isolated() == ["a"]
@@ -0,0 +1,125 @@
+from __future__ import annotations
+
+import gc
+import json
+import tracemalloc
+
+import pytest
+
+from app.compact import NodeRec, pack, unpack
+from conftest import ODD_NODES
+
+
+def _roundtrip(data):
+    return unpack(pack(data))
+
+
+@pytest.mark.parametrize("node", ODD_NODES)
+def test_node_roundtrip_is_exact(node):
+    out = _roundtrip({"nodes": [node]})["nodes"][0]
+    assert out == node
+    # equal-but-differently-typed values (1 / 1.0 / True) must survive too
+    assert json.dumps(out, sort_keys=True) == json.dumps(node, sort_keys=True)
+
+
+def test_document_roundtrip_keeps_rest():
+    data = {
+        "nodes": ODD_NODES,
+        "links": [{"id": "l1", "source": "n1", "target": "n2"}],
+        "suppressedAutoPairs": [{"a": "n1", "b": "n2"}],
+        "autoEdgeOverrides": {"n1|n2": {"cpd": 1}},
+        "groups": [{"id": "g1", "nodeIds": ["n1"]}],
+    }
+    assert _roundtrip(data) == data
+
+
+def test_non_string_types_do_not_become_enum_codes():
+    node = {"id": "n", "fields": [{"key": "k", "type": 1, "value": "v"}]}
+    out = _roundtrip({"nodes": [node]})["nodes"][0]
+    assert out["fields"][0]["type"] == 1
+    assert out["fields"][0]["type"] != "tag"
+
+
+def test_unpack_builds_fresh_objects():
+    doc = pack({"nodes": [{"id": "n", "fields": [{"key": "k", "type": "text", "value": ["a"]}], "position": [0, 0], "meta": {"a": 1}}]})
+    first = unpack(doc)
+    first["nodes"][0]["fields"][0]["value"].append("b")
+    first["nodes"][0]["position"].append(9)
+    first["nodes"][0]["meta"]["a"] = 2
+    assert unpack(doc) == {"nodes": [{"id": "n", "fields": [{"key": "k", "type": "text", "value": ["a"]}], "position": [0, 0], "meta": {"a": 1}}]}
+
+
+def test_pack_reuses_unchanged_records():
+    data = {"nodes": [
+        {"id": "a", "fields": [{"key": "名称", "type": "text", "value": "A"}], "position": {"x": 0, "y": 0}},
+        {"id": "b", "fields": [{"key": "名称", "type": "text", "value": "B"}], "position": {"x": 1, "y": 1}},
+    ]}
+    base = pack(data)
+    edited = unpack(base)
+    edited["nodes"][1]["position"] = {"x": 5, "y": 1}
+    doc = pack(edited, base)
+    assert doc.nodes[0] is base.nodes[0]
+    assert doc.nodes[1] is not base.nodes[1]
+    assert unpack(doc) == edited
+
+
+@pytest.mark.parametrize("old, new", [
+    (1, 1.0),
+    (1, True),
+    (0.0, False),
+    ("1", 1),
+])
+def test_pack_does_not_reuse_records_with_differently_typed_values(old, new):
+    base = pack({"nodes": [{"id": "a", "fields": [{"key": "k", "type": "number", "value": old}], "position": {"x": old, "y": 0}}]})
+    node = {"id": "a", "fields": [{"key": "k", "type": "number", "value": new}], "position": {"x": new, "y": 0}}
+    doc = pack({"nodes": [node]}, base)
+    assert doc.nodes[0] is not base.nodes[0]
+    assert json.dumps(unpack(doc)["nodes"][0]) == json.dumps(node)
+
+
+@pytest.mark.parametrize("node", ODD_NODES)
+def test_matches_agrees_with_roundtrip(node):
+    rec = NodeRec.pack(node)
+    assert rec.matches(node)
+    assert rec.matches(rec.unpack())
+
+
+def _module(n):
+    # shaped like a real module: Chinese names and prose, a tag, a place, notes
+    nodes = [{"id": f"node-{i:06d}", "fields": [
+        {"key": "名称", "type": "text", "value": f"角色{i}"},
+        {"key": "标签", "type": "tag", "value": ["NPC", "地点", "线索"][i % 3]},
+        {"key": "地点", "type": "text", "value": f"地点{i % 97}"},
+        {"key": "描述", "type": "text", "value": "这是一段较长的描述文字，" * 3 + str(i)},
+        {"key": "Notes", "type": "text", "value": f"Met at Dock {i % 50}"},
+        {"key": "等级", "type": "number", "value": i % 10},
+    ], "position": {"x": i * 1.5, "y": i * 0.5}} for i in range(n)]
+    return json.dumps({"nodes": nodes}, ensure_ascii=False)
+
+
+def _traced_bytes(fn):
+    gc.collect()
+    tracemalloc.start()
+    try:
+        obj = fn()
+        gc.collect()
+        return obj, tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+
+
+def test_packed_nodes_stay_small():
+    # Guards the in-memory footprint: match keys must not bring back per-field objects
+    n = 5000
+    raw = _module(n)
+    data, dict_bytes = _traced_bytes(lambda: json.loads(raw))
+
+    def packed():
+        doc = pack(data)
+        doc.match_keys()  # views over the records; nothing is kept on them
+        return doc
+
+    doc, packed_bytes = _traced_bytes(packed)
+    assert len(doc.nodes) == n
+    assert packed_bytes / n < 1200
+    assert dict_bytes / packed_bytes > 2.7
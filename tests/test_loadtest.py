@@ -0,0 +1,77 @@
+from __future__ import annotations
+
+import json
+import os
+
+from app import loadtest, storage
+from app.loadtest import _percentile, compare, load_recording
+from app.main import create_app
+
+
+def test_percentile_is_nearest_rank():
+    ms = [float(i) for i in range(1, 101)]
+    assert _percentile(ms, 50) == 50.0
+    assert _percentile(ms, 95) == 95.0
+    assert _percentile(ms, 99) == 99.0
+    assert _percentile(ms, 100) == 100.0
+    assert _percentile([7.0], 99) == 7.0
+    assert _percentile([], 50) == 0.0
+
+
+def test_compare_flags_only_p95_regressions_past_threshold():
+    baseline = {
+        "GET /api/data": {"p95": 10.0},
+        "POST /api/undo": {"p95": 10.0},
+        "PUT /api/nodes/<node_id>": {"p95": 0},
+    }
+    current = {
+        "GET /api/data": {"p95": 13.0},
+        "POST /api/undo": {"p95": 12.0},
+        "PUT /api/nodes/<node_id>": {"p95": 50.0},
+        "POST /api/nodes": {"p95": 99.0},
+    }
+    assert compare(current, baseline, 1.25) == ["GET /api/data: p95 13.00ms > 1.25 x baseline 10.00ms"]
+    assert compare(current, baseline, 1.5) == []
+
+
+def test_load_recording_skips_blank_and_malformed_lines(tmp_path):
+    path = tmp_path / "rec.jsonl"
+    lines = [
+        json.dumps({"method": "GET", "path": "/api/data"}),
+        "",
+        "not json",
+        json.dumps({"method": "POST", "path": "/api/nodes", "body": {"fields": []}}),
+        json.dumps({"path": "/api/data"}),
+        json.dumps({"method": "PUT", "path": "/api/x", "text": "a,b", "contentType": "text/csv"}),
+        json.dumps(["GET", "/api/data"]),
+    ]
+    path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+    assert load_recording(str(path)) == [
+        ("GET", "/api/data", None, None, None),
+        ("POST", "/api/nodes", {"fields": []}, None, None),
+        ("PUT", "/api/x", None, "a,b", "text/csv"),
+    ]
+
+
+def test_recorder_writes_one_replayable_line_per_api_call(client, tmp_path, monkeypatch):
+    path = tmp_path / "rec.jsonl"
+    monkeypatch.setenv("RECORD_REQUESTS", str(path))
+    c = create_app().test_client()
+    body = {"fields": [{"key": "名称", "type": "text", "value": "林清秋"}], "position": {"x": 0, "y": 0}}
+    assert c.post("/api/nodes", json=body).status_code < 400
+    c.get("/")  # not an /api call, not recorded
+    entries = [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+    assert len(entries) == 1
+    e = entries[0]
+    assert (e["method"], e["path"], e["route"], e["body"]) == ("POST", "/api/nodes", "/api/nodes", body)
+    assert e["status"] < 400 and e["ms"] >= 0 and e["contentType"] == "application/json"
+    assert load_recording(str(path)) == [("POST", "/api/nodes", body, None, "application/json")]
+
+
+def test_in_process_run_leaves_app_files_alone(sqlite_client, tmp_path, capsys):
+    paths = (storage.DATA_PATH, storage.TEMPLATES_PATH, storage.SQLITE_PATH)
+    assert loadtest.main(["--clients", "2", "--ops", "5", "--seed-nodes", "3"]) == 0
+    assert "total" in capsys.readouterr().out
+    assert (storage.DATA_PATH, storage.TEMPLATES_PATH, storage.SQLITE_PATH) == paths
+    assert not any(os.path.exists(p) for p in paths)
+    assert not (tmp_path / "snapshots").exists()
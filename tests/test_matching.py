@@ -0,0 +1,47 @@
+from __future__ import annotations
+
+from app import matching
+from app.compact import pack, unpack
+from app.utils import compute_auto_links
+from conftest import ODD_NODES
+
+NODES = [
+    {"id": "a", "fields": [{"key": "名称", "type": "text", "value": "林清秋"}, {"key": "标签", "type": "tag", "value": "NPC"}]},
+    {"id": "b", "fields": [{"key": "npc", "type": "text", "value": "林清秋 "}]},
+    {"id": "c", "fields": [{"key": "名称", "type": "text", "value": "邮局"}, {"key": "Aliases", "type": "text", "value": "Post，ＰＯ"}, {"key": "标签", "type": "tag", "value": "地点"}]},
+    {"id": "d", "fields": [{"key": "地点", "type": "text", "value": "po"}]},
+]
+
+
+def _pairs(links):
+    return sorted((e["source"], e["target"]) for e in links)
+
+
+def test_normalized_matching():
+    assert _pairs(compute_auto_links(NODES)) == [("b", "a"), ("d", "c")]
+
+
+def test_stored_keys_give_the_same_links():
+    doc = pack({"nodes": NODES})
+    assert all(matching.is_current(r.keys) for r in doc.nodes)
+    data = unpack(doc)
+    assert compute_auto_links(data["nodes"], None, doc.match_keys()) == compute_auto_links(NODES)
+    assert compute_auto_links(data["nodes"], ["地点"], doc.match_keys()) == compute_auto_links(NODES, ["地点"])
+
+
+
+def test_stored_keys_on_odd_fields():
+    nodes = ODD_NODES + NODES
+    doc = pack({"nodes": nodes})
+    assert compute_auto_links(unpack(doc)["nodes"], None, doc.match_keys()) == compute_auto_links(nodes)
+    assert compute_auto_links(unpack(doc)["nodes"], None, doc.match_keys()) != []
+
+
+def test_reconfigure_refreshes_stored_keys():
+    doc = pack({"nodes": NODES})
+    try:
+        matching.configure("none")
+        assert compute_auto_links(unpack(doc)["nodes"], None, doc.match_keys()) == []
+    finally:
+        matching.configure()
+    assert _pairs(compute_auto_links(unpack(doc)["nodes"], None, doc.match_keys())) == [("b", "a"), ("d", "c")]
@@ -0,0 +1,87 @@
+from __future__ import annotations
+
+import random
+
+from app import storage
+from app.refs import RefIndex
+
+
+def _as_sets(idx: RefIndex):
+    return idx.pairs, idx.pairs_by_node, idx.groups_by_node, idx.overrides_by_node
+
+
+def test_mutations_keep_the_index_in_place(client):
+    rng = random.Random(7)
+    ids = [client.post("/api/nodes", json={"fields": []}).get_json()["id"] for _ in range(8)]
+    gids: list = []
+    for _ in range(150):
+        op = rng.random()
+        a, b = rng.sample(ids, 2)
+        if op < 0.25:
+            client.post("/api/auto/suppress", json={"a": a, "b": b})
+        elif op < 0.4:
+            client.post("/api/auto/unsuppress", json={"a": a, "b": b})
+        elif op < 0.55:
+            client.post("/api/auto/edge/cpd", json={"source": a, "target": b, "cpd": rng.random()})
+        elif op < 0.65:
+            gids.append(client.post("/api/groups", json={"members": rng.sample(ids, 3)}).get_json()["id"])
+        elif op < 0.75 and gids:
+            client.put(f"/api/groups/{rng.choice(gids)}", json={"members": rng.sample(ids, 2)})
+        elif op < 0.8 and gids:
+            client.delete(f"/api/groups/{gids.pop(rng.randrange(len(gids)))}")
+        elif op < 0.9:
+            gone = rng.choice(ids)
+            client.delete(f"/api/nodes/{gone}")
+            ids.remove(gone)
+            ids.append(client.post("/api/nodes", json={"fields": []}).get_json()["id"])
+        kept = storage._REFS
+        fresh = RefIndex.build(storage.current_state().rest)
+        if kept is not None:
+            assert _as_sets(kept) == _as_sets(fresh)
+    assert storage._REFS is not None
+
+
+def test_suppress_after_write_does_not_rebuild(client, monkeypatch):
+    a = client.post("/api/nodes", json={"fields": []}).get_json()["id"]
+    b = client.post("/api/nodes", json={"fields": []}).get_json()["id"]
+    client.post("/api/auto/suppress", json={"a": a, "b": b})
+    builds = []
+    orig = RefIndex.build
+    monkeypatch.setattr(RefIndex, "build", classmethod(lambda cls, data: builds.append(1) or orig(data)))
+    client.post("/api/auto/unsuppress", json={"a": a, "b": b})
+    client.post("/api/auto/suppress", json={"a": b, "b": a})
+    client.post("/api/auto/suppress", json={"a": a, "b": b})
+    client.delete(f"/api/nodes/{a}")
+    assert builds == []
+    assert client.get("/api/auto/suppressed").get_json() == []
+
+
+def test_pending_changes_stay_out_of_the_shared_index(client):
+    a = client.post("/api/nodes", json={"fields": []}).get_json()["id"]
+    b = client.post("/api/nodes", json={"fields": []}).get_json()["id"]
+    key = (a, b) if a <= b else (b, a)
+    # a write in flight: recorded, not yet applied
+    data, refs, changes = storage.read_with_refs()
+    data.setdefault("suppressedAutoPairs", []).append({"a": key[0], "b": key[1]})
+    changes.add_pair(key)
+    assert not refs.has_pair(a, b)
+    # so a concurrent suppress of the same pair is not mistaken for a no-op
+    client.post("/api/auto/suppress", json={"a": b, "b": a})
+    assert client.get("/api/auto/suppressed").get_json() == [{"a": key[0], "b": key[1]}]
+    # the stale write lands after it: its changes are dropped, not applied
+    storage.write_all(data, changes)
+    assert storage._REFS is None
+    assert storage.read_with_refs()[1].has_pair(a, b)
+
+
+def test_changes_apply_when_no_other_write_came_first(client):
+    a = client.post("/api/nodes", json={"fields": []}).get_json()["id"]
+    b = client.post("/api/nodes", json={"fields": []}).get_json()["id"]
+    data, refs, changes = storage.read_with_refs()
+    data["groups"] = [{"id": "g", "members": [a, b]}]
+    changes.set_group("g", [], data["groups"][0]["members"])
+    data["groups"][0]["members"].remove(b)  # later edits to data do not leak into changes
+    changes.set_group("g", [a, b], [a])
+    storage.write_all(data, changes)
+    assert storage._REFS is refs
+    assert _as_sets(refs) == _as_sets(RefIndex.build(storage.current_state().rest))
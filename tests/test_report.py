@@ -0,0 +1,95 @@
+from __future__ import annotations
+
+import random
+import re
+
+import pytest
+
+from app import main, report, storage
+from app.compact import PackedDoc
+from conftest import NAMES, mutate, random_fields
+
+def _fresh():
+    # A state the cache was not built from (and an older generation) is rendered from scratch
+    doc, _ = storage.versioned_state()
+    doc = PackedDoc(doc.nodes, doc.rest)
+    suppressed = {tuple(sorted((p["a"], p["b"]))) for p in doc.rest.get("suppressedAutoPairs", [])}
+
+    def visible():
+        auto = main.rule_b_links([r.id for r in doc.nodes], doc.match_keys())
+        return [e for e in auto if tuple(sorted((e["source"], e["target"]))) not in suppressed]
+
+    return "".join(report.iter_markdown(doc, -1, visible))
+
+
+@pytest.mark.parametrize("seed", [1, 2, 3])
+def test_cached_export_matches_fresh_render(client, seed):
+    rng = random.Random(seed)
+    counter = [0]
+    data = storage.read_all()
+    data.setdefault("links", []); data.setdefault("suppressedAutoPairs", [])
+    data["nodes"] = [{"id": f"s{i}", "fields": random_fields(rng), "position": {"x": i, "y": 0}} for i in range(40)]
+    for _ in range(30):
+        mutate(data, rng, counter)
+    storage.write_all(data)
+    for _ in range(120):
+        for _ in range(rng.randint(1, 3)):
+            mutate(data, rng, counter)
+        storage.write_all(data)
+        if rng.random() < 0.5:
+            assert client.get("/api/export/md").get_data(as_text=True) == _fresh()
+
+
+def test_each_anchor_is_emitted_once(client):
+    client.post("/api/nodes", json={"fields": [{"key": "标签", "type": "tag", "value": "NPC"}, {"key": "标签", "type": "tag", "value": "地点"}]})
+    text = client.get("/api/export/md").get_data(as_text=True)
+    anchors = re.findall(r'<a id="(node-[^"]+)"></a>', text)
+    assert len(anchors) == 1
+    assert text.count("### ") == 2  # still listed under both tags
+
+
+def test_warm_export_skips_auto_links(client, monkeypatch):
+    for name in NAMES:
+        client.post("/api/nodes", json={"fields": [{"key": "名称", "type": "text", "value": name}]})
+    calls = []
+    real = main.rule_b_links
+    monkeypatch.setattr(main, "rule_b_links", lambda *a: calls.append(1) or real(*a))
+    first = client.get("/api/export/md").get_data(as_text=True)
+    assert client.get("/api/export/md").get_data(as_text=True) == first
+    assert len(calls) == 1
+    data = storage.read_all()
+    data["nodes"][0]["position"] = {"x": 5, "y": 5}
+    storage.write_all(data)
+    assert client.get("/api/export/md").get_data(as_text=True) == first
+    assert len(calls) == 1
+    data["nodes"][0]["fields"][0]["value"] = "新名字"
+    storage.write_all(data)
+    assert "新名字" in client.get("/api/export/md").get_data(as_text=True)
+    assert len(calls) == 2
+
+
+def test_tag_anchors_are_unique_slugs(client):
+    for tag in ["NPC", "npc ", "地点", "！！"]:
+        client.post("/api/nodes", json={"fields": [{"key": "标签", "type": "tag", "value": tag}]})
+    text = client.get("/api/export/md").get_data(as_text=True)
+    targets = re.findall(r"\]\(#(tag-[^)]*)\)", text)
+    anchors = re.findall(r'<a id="(tag-[^"]*)"></a>', text)
+    assert targets == anchors == ["tag-npc", "tag-npc-2", "tag-di-dian", "tag-section"]
+
+
+def test_write_listener_does_not_use_the_analytics_index(client, monkeypatch):
+    from app import analytics
+
+    for name in NAMES:
+        client.post("/api/nodes", json={"fields": [{"key": "名称", "type": "text", "value": name}, {"key": "标签", "type": "tag", "value": "NPC"}]})
+    client.get("/api/export/md").get_data()
+
+    def boom(*a, **k):
+        raise AssertionError("report must not depend on the analytics index")
+
+    monkeypatch.setattr(analytics, "synced", boom)
+    data = storage.read_all()
+    data["nodes"].append({"id": "late", "fields": [{"key": "NPC", "type": "text", "value": NAMES[0]}]})
+    storage.write_all(data)
+    assert report._FRAGMENTS  # the write dropped only what it affects
+    assert client.get("/api/export/md").get_data(as_text=True) == _fresh()
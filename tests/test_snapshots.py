@@ -0,0 +1,75 @@
+from __future__ import annotations
+
+import hashlib
+import os
+
+import pytest
+
+from app import snapshots
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(snapshots, "SNAPSHOT_DIR", str(tmp_path))
+    monkeypatch.setattr(snapshots, "_KNOWN", None)
+    monkeypatch.setattr(snapshots, "KEEP_LAST", 1)
+    monkeypatch.setattr(snapshots, "KEEP_DAILY", 0)
+    return tmp_path
+
+
+def _data(n=500):
+    return {
+        "nodes": [{"id": f"n{i}", "fields": [{"key": "名称", "type": "text", "value": f"x{i}"}], "position": {"x": i, "y": 0}} for i in range(n)],
+        "links": [{"id": f"l{i}", "source": f"n{i}", "target": f"n{i + 1}"} for i in range(n // 2)],
+        "groups": [{"id": "g", "members": ["n1", "n2"]}],
+        "suppressedAutoPairs": [{"a": "n1", "b": "n2"}],
+        "autoEdgeOverrides": {"n1->n2": 0.5, "n3->n4": 1},
+    }
+
+
+def _chunks(root):
+    return {name for _, _, files in os.walk(root / "chunks") for name in files}
+
+
+def test_roundtrip_and_unchanged_snapshot_is_free(store, monkeypatch):
+    monkeypatch.setattr(snapshots, "KEEP_LAST", 10)
+    data = _data()
+    first = snapshots.create_snapshot(data, "manual")
+    assert snapshots.load_snapshot(first["id"]) == data
+    again = snapshots.create_snapshot(data, "manual")
+    assert again["bytesAdded"] == 0
+    assert os.path.getsize(store / "manifests" / f"{again['id']}.json") < 1024
+
+
+def test_small_edit_costs_little(store, monkeypatch):
+    monkeypatch.setattr(snapshots, "KEEP_LAST", 10)
+    data = _data(5000)
+    first = snapshots.create_snapshot(data, "manual")
+    data["nodes"][2500]["position"] = {"x": -1, "y": -1}
+    del data["nodes"][100]
+    second = snapshots.create_snapshot(data, "manual")
+    assert second["bytesAdded"] < first["bytesAdded"] / 20
+    assert snapshots.load_snapshot(second["id"]) == data
+
+
+def test_prune_sweeps_orphans(store):
+    data = _data()
+    snapshots.create_snapshot(data, "manual")
+    gone = hashlib.sha256(snapshots._canonical(data["nodes"][400])).hexdigest()
+    assert gone in _chunks(store)
+    data["nodes"] = data["nodes"][:10]
+    latest = snapshots.create_snapshot(data, "manual")
+    assert [s["id"] for s in snapshots.list_snapshots()] == [latest["id"]]
+    assert gone not in _chunks(store)
+    assert snapshots.load_snapshot(latest["id"]) == data
+
+
+def test_unreadable_manifest_blocks_the_sweep(store):
+    data = _data()
+    old = snapshots.create_snapshot(data, "manual")
+    chunks = _chunks(store)
+    (store / "manifests" / "00000000-broken.json").write_bytes(b"{not json")
+    data["nodes"] = data["nodes"][:10]
+    snapshots.create_snapshot(data, "manual")
+    assert not (store / "manifests" / f"{old['id']}.json").exists()
+    assert chunks <= _chunks(store)
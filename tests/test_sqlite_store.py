@@ -0,0 +1,120 @@
+from __future__ import annotations
+
+import json
+import random
+
+import pytest
+
+from app import storage
+from app.sqlite_store import SqliteStore
+from app.utils import auto_links_from_matches, compute_auto_links
+from conftest import ODD_NODES, random_node
+
+
+def _store(tmp_path, name="data.sqlite"):
+    store = SqliteStore(str(tmp_path / name))
+    store.load()
+    return store
+
+
+def _ids(store):
+    return [n["id"] for n in SqliteStore(store.path).load()["nodes"]]
+
+
+def test_delete_touches_only_the_deleted_rows(tmp_path):
+    store = _store(tmp_path)
+    data = {
+        "nodes": [{"id": f"n{i}", "fields": []} for i in range(50)],
+        "links": [{"id": f"l{i}", "source": "n0", "target": f"n{i}"} for i in range(50)],
+    }
+    store.save(data)
+    stmts = []
+    store._conn.set_trace_callback(stmts.append)
+    data["nodes"].pop(0)
+    data["links"].pop(0)
+    store.save(data)
+    writes = [s for s in stmts if s.split()[0] in ("INSERT", "UPDATE", "DELETE")]
+    assert not [s for s in writes if s.startswith("UPDATE")]
+    assert all("'n0'" in s or "'l0'" in s for s in writes)
+
+
+def test_order_survives_random_moves(tmp_path):
+    rng = random.Random(1)
+    store = _store(tmp_path)
+    nodes = [{"id": f"n{i}", "fields": []} for i in range(20)]
+    store.save({"nodes": nodes})
+    for step in range(300):
+        op = rng.random()
+        if op < 0.3:
+            nodes.insert(rng.randrange(len(nodes) + 1), {"id": f"x{step}", "fields": []})
+        elif op < 0.5 and nodes:
+            nodes.pop(rng.randrange(len(nodes)))
+        elif nodes:
+            nodes.insert(rng.randrange(len(nodes) + 1), nodes.pop(rng.randrange(len(nodes))))
+        store.save({"nodes": nodes})
+        assert _ids(store) == [n["id"] for n in nodes]
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_indexed_rule_b_matches_compute_auto_links(tmp_path, seed):
+    rng = random.Random(seed)
+    store = _store(tmp_path, f"rule_b_{seed}.sqlite")
+    nodes = [random_node(rng, f"n{i}") for i in range(40)]
+    rng.shuffle(nodes)
+    store.save({"nodes": nodes}, generation=1)
+    for filters in (None, ["NPC"], ["地点", "npc"], [""]):
+        rows = store.rule_b_pairs(filters, generation=1)
+        assert auto_links_from_matches(rows) == compute_auto_links(nodes, filters)
+    assert store.rule_b_pairs(None, generation=2) is None
+
+
+def test_reset_is_not_undone_by_reseeding_on_restart(sqlite_client, tmp_path, monkeypatch):
+    client = sqlite_client
+    (tmp_path / "data.json").write_text(json.dumps({"nodes": [{"id": "old", "fields": []}]}), encoding="utf-8")
+    assert [n["id"] for n in client.get("/api/data").get_json()["nodes"]] == ["old"]
+    client.post("/api/reset")
+    storage._flush_to_disk_safe()
+    storage._SQLITE.close()
+    # restart: fresh store and cache, data.json still holds the old document
+    monkeypatch.setattr(storage, "_SQLITE", None)
+    monkeypatch.setattr(storage, "_CACHE", None)
+    assert client.get("/api/data").get_json()["nodes"] == []
+
+
+def test_non_string_values_stay_out_of_indexed_columns(sqlite_client):
+    client = sqlite_client
+    nid = client.post("/api/nodes", json={"fields": [{"key": ["k"], "type": {"t": 1}, "value": "v"}]}).get_json()["id"]
+    client.post("/api/links", json={"source": {"id": nid}, "target": [nid]})
+    storage._flush_to_disk_safe()
+    assert not storage._DIRTY
+    store = SqliteStore(storage.SQLITE_PATH)
+    assert store.load() == storage.read_all()
+    assert store._conn.execute("SELECT field_key, field_type FROM fields").fetchall() == [(None, None)]
+    assert store._conn.execute("SELECT source, target FROM links").fetchall() == [(None, None)]
+
+
+def test_json_roundtrip_is_exact(tmp_path):
+    data = {
+        "nodes": ODD_NODES + [{"id": "n1", "fields": [{"key": "dup", "type": "text", "value": "v"}]}, {"id": "\0x", "fields": []}],
+        "links": [
+            {"id": "l1", "source": "n1", "target": "n2"},
+            {"source": "n1", "target": "n3"},
+            {"id": 5, "source": ["n2"], "target": "n1"},
+            {"id": "l1", "label": "same id"},
+        ],
+        "groups": [{"label": "no id", "members": ["n1"]}, {"id": "g1", "members": "n1"}],
+        "suppressedAutoPairs": [{"a": "n1", "b": "n2"}],
+        "autoEdgeOverrides": {"n1->n2": 0.5},
+        "extra": {"k": [1, 1.0, True]},
+    }
+    store = _store(tmp_path)
+    store.save(data)
+    out = SqliteStore(store.path).load()
+    assert out == data
+    assert json.dumps(out, sort_keys=True) == json.dumps(data, sort_keys=True)
+    # rows with ordinal keys are updated and deleted like any other
+    data["nodes"].pop(-3)
+    data["links"].pop(1)
+    data["groups"][0]["label"] = "renamed"
+    store.save(data)
+    assert SqliteStore(store.path).load() == data
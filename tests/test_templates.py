@@ -0,0 +1,107 @@
+from __future__ import annotations
+
+import json
+import os
+
+import pytest
+
+from app import storage
+
+
+def _instantiate(client, body, name="NPC"):
+    return client.post(f"/api/templates/{name}/instantiate", json=body)
+
+
+def _values(node):
+    return {f["key"]: f["value"] for f in node["fields"]}
+
+
+def test_count_and_items_overrides(client):
+    r = _instantiate(client, {"count": 3, "items": [
+        {"values": {"名称": "林清秋", "口头禅": "嗯"}, "fields": [{"key": "备注", "type": "text", "value": "x"}]},
+        {"position": {"x": 7, "y": 8}},
+    ]})
+    assert r.status_code == 200
+    nodes = r.get_json()["nodes"]
+    assert len(nodes) == 3
+    first = nodes[0]
+    assert _values(first)["名称"] == "林清秋"
+    assert _values(first)["标签"] == "NPC"
+    # unknown keys are appended as text, extra fields after the template's
+    assert [f["key"] for f in first["fields"]] == ["名称", "标签", "地点", "动机", "口头禅", "备注"]
+    assert nodes[1]["position"] == {"x": 7, "y": 8}
+    assert _values(nodes[2])["名称"] == ""
+    assert len({n["id"] for n in nodes}) == 3
+    # more items than count: one node per item
+    r = _instantiate(client, {"count": 1, "items": [{}, {}, {}, {}]}, name="地点")
+    assert len(r.get_json()["nodes"]) == 4
+
+
+def test_grid_is_centered_on_center(client):
+    nodes = _instantiate(client, {"count": 4, "spacing": 100, "center": {"x": 10, "y": 20}}).get_json()["nodes"]
+    assert [n["position"] for n in nodes] == [
+        {"x": -40, "y": -30}, {"x": 60, "y": -30},
+        {"x": -40, "y": 70}, {"x": 60, "y": 70},
+    ]
+    nodes = _instantiate(client, {"count": 5, "spacing": 10, "columns": 5, "center": {"x": 0, "y": 0}}).get_json()["nodes"]
+    assert [(n["position"]["x"], n["position"]["y"]) for n in nodes] == [(-20, 0), (-10, 0), (0, 0), (10, 0), (20, 0)]
+
+
+def test_batch_undoes_and_redoes_as_one_step(client):
+    client.post("/api/nodes", json={"fields": [], "position": {"x": 0, "y": 0}})
+    before = client.get("/api/data").get_json()["nodes"]
+    created = _instantiate(client, {"count": 5, "center": {"x": 0, "y": 0}}).get_json()["nodes"]
+    assert len(client.get("/api/data").get_json()["nodes"]) == len(before) + 5
+    assert client.post("/api/undo").status_code == 200
+    assert [n["id"] for n in client.get("/api/data").get_json()["nodes"]] == [n["id"] for n in before]
+    assert client.post("/api/redo").status_code == 200
+    after = [n["id"] for n in client.get("/api/data").get_json()["nodes"]]
+    assert after[len(before):] == [n["id"] for n in created]
+
+
+@pytest.mark.parametrize("body, error", [
+    ({"count": 0}, "invalid count"),
+    ({"count": 1001}, "invalid count"),
+    ({"count": "many"}, "invalid count"),
+    ({"count": 2, "spacing": "wide"}, "invalid spacing"),
+    ({"count": 2, "spacing": "nan"}, "invalid spacing"),
+    ({"count": 2, "spacing": "inf"}, "invalid spacing"),
+    ({"count": 2, "spacing": "-Infinity"}, "invalid spacing"),
+    ({"count": 2, "columns": "two"}, "invalid columns"),
+    ({"count": 2, "items": {"a": 1}}, "invalid items"),
+])
+def test_invalid_parameters_are_rejected(client, body, error):
+    r = _instantiate(client, body)
+    assert r.status_code == 400
+    assert r.get_json()["error"] == error
+    assert client.get("/api/data").get_json()["nodes"] == []
+
+
+def test_unknown_template_is_404(client):
+    assert _instantiate(client, {"count": 1}, name="nope").status_code == 404
+
+
+def test_templates_reload_when_the_file_changes(client):
+    assert set(client.get("/api/templates").get_json()) == {"NPC", "地点"}
+    path = storage.TEMPLATES_PATH
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"线索": [{"key": "名称", "type": "text", "value": "旧信"}]}, f, ensure_ascii=False)
+    # make the change visible even on filesystems with coarse mtimes
+    st = os.stat(path)
+    os.utime(path, (st.st_atime, st.st_mtime + 5))
+    assert set(client.get("/api/templates").get_json()) == {"线索"}
+    nodes = _instantiate(client, {"count": 1}, name="线索").get_json()["nodes"]
+    assert _values(nodes[0]) == {"名称": "旧信"}
+    # an unchanged file is served from the cache
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"其他": []}, f)
+    os.utime(path, (st.st_atime, st.st_mtime + 5))
+    assert set(client.get("/api/templates").get_json()) == {"线索"}
+
+
+def test_saved_templates_win_over_the_file_until_flushed(client):
+    client.post("/api/templates", json={"势力": [{"key": "名称", "type": "text", "value": ""}]})
+    assert set(client.get("/api/templates").get_json()) == {"势力"}
+    storage._flush_to_disk_safe()
+    with open(storage.TEMPLATES_PATH, encoding="utf-8") as f:
+        assert set(json.load(f)) == {"势力"}